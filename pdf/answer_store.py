@@ -0,0 +1,93 @@
+"""
+Durable store for answers from rag.py and chat.py.
+
+One row per (paper hash, question id, question text hash, model), written as
+soon as the answer arrives, so an interrupted run resumes with only the
+missing answers. The Markdown files are rendered from here instead of being
+appended to question by question.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+
+ANSWER_STORE_PATH = "./docs/answers.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    paper_hash    TEXT NOT NULL,
+    question_id   INTEGER NOT NULL,
+    question_hash TEXT NOT NULL,
+    model         TEXT NOT NULL,
+    paper         TEXT NOT NULL,
+    question      TEXT NOT NULL,
+    answer        TEXT NOT NULL,
+    citations     TEXT NOT NULL DEFAULT '',
+    seconds       REAL,
+    created_at    TEXT NOT NULL,
+    PRIMARY KEY (paper_hash, question_id, question_hash, model)
+)
+"""
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def render_section(question: dict, answer: str, citations: str = "") -> str:
+    """One question in the Markdown layout both scripts have always used."""
+    body = f"{answer}\n\nCitations:\n{citations}".strip() if citations else answer.strip()
+    return (
+        f"## Question {question['id']}\n"
+        f"**{question['question']}**\n"
+        f"{body}\n\n"
+    )
+
+
+class AnswerStore:
+    """Thread-safe: rag.py stores answers from its worker threads."""
+
+    def __init__(self, path: str = ANSWER_STORE_PATH):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+        self._lock = threading.Lock()
+
+    def get(self, paper_hash: str, question: dict, model: str):
+        """Return (answer, citations) or None when this question was not answered yet."""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT answer, citations FROM answers "
+                "WHERE paper_hash = ? AND question_id = ? AND question_hash = ? AND model = ?",
+                (paper_hash, question["id"], text_hash(question["question"]), model),
+            ).fetchone()
+        return row
+
+    def put(self, paper: str, paper_hash: str, question: dict, model: str,
+            answer: str, citations: str = "", seconds: float = None):
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO answers "
+                "(paper_hash, question_id, question_hash, model, paper, question, answer, citations, seconds, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (paper_hash, question["id"], text_hash(question["question"]), model, paper,
+                 question["question"], answer, citations, seconds, time.strftime("%Y-%m-%d %H:%M:%S")),
+            )
+            self.conn.commit()
+
+    def pending(self, paper_hash: str, questions: list, model: str) -> list:
+        return [q for q in questions if self.get(paper_hash, q, model) is None]
+
+    def render_markdown(self, paper_hash: str, questions: list, model: str) -> str:
+        """The paper's Markdown in questions order, skipping questions without an answer."""
+        sections = []
+        for question in questions:
+            row = self.get(paper_hash, question, model)
+            if row is not None:
+                sections.append(render_section(question, *row))
+        return "".join(sections)
+
+    def close(self):
+        self.conn.close()
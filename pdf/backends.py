@@ -0,0 +1,255 @@
+"""
+Embedding and LLM backends for rag.py and chat.py.
+
+"openai" is the real thing. "offline" needs no network or API key: hashed
+character n-gram embeddings computed with NumPy, and a fake chat model that
+answers with the first sentences of its context after a configurable delay.
+It exists so throughput, concurrency and caching can be measured end to end
+without spending money.
+
+Pick one with --backend or the LITREVIEW_BACKEND environment variable;
+LITREVIEW_OFFLINE_LATENCY sets the fake model's delay in seconds.
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from langchain.llms.base import LLM
+
+BACKENDS = ("openai", "offline")
+DEFAULT_BACKEND = os.environ.get("LITREVIEW_BACKEND", "openai")
+OFFLINE_LATENCY = float(os.environ.get("LITREVIEW_OFFLINE_LATENCY", "0.5"))
+
+OFFLINE_EMBEDDING_DIM = 512
+# Uploaded files and batches of the fake client, so a batch survives a restart like a real one
+OFFLINE_BATCH_DIR = "./docs/cache/offline_batches"
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Bag of hashed character 3- to 5-grams, L2-normalised. Deterministic, so
+    the embedding cache and FAISS indexes behave exactly as with real vectors.
+    """
+
+    def __init__(self, dim: int = OFFLINE_EMBEDDING_DIM, ngram_range=(3, 5)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    @property
+    def model(self) -> str:
+        return f"offline-hashing-{self.dim}"
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        text = " ".join(text.lower().split())
+        for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+            for i in range(len(text) - n + 1):
+                digest = hashlib.blake2b(text[i:i + n].encode("utf-8"), digest_size=8).digest()
+                bucket = int.from_bytes(digest, "little")
+                # The sign bit keeps colliding n-grams from only ever adding up
+                vector[bucket % self.dim] += 1.0 if bucket >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def fake_answer(prompt: str) -> str:
+    """The first two sentences after 'Context:', so answers still point at the text."""
+    context = prompt.split("Context:", 1)[-1]
+    sentences = re.split(r"(?<=[.!?])\s+", " ".join(context.split()))
+    return "Offline answer: " + " ".join(sentences[:2])[:400]
+
+
+def sleep_latency(latency: float):
+    if latency > 0:
+        time.sleep(random.uniform(0.5 * latency, 1.5 * latency))
+
+
+class FakeChatModel(LLM):
+    """LangChain LLM that sleeps for about `latency` seconds and returns fake_answer(prompt)."""
+
+    latency: float = OFFLINE_LATENCY
+
+    @property
+    def _llm_type(self) -> str:
+        return "offline-fake"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        sleep_latency(self.latency)
+        return fake_answer(prompt)
+
+
+def fake_json_answers(prompt: str, request: dict) -> str:
+    """Answer a {"questions": [{"id", "question"}, ...]} request with {"answers": {id: answer}}."""
+    answer = fake_answer(prompt)
+    return json.dumps({"answers": {str(q["id"]): answer for q in request["questions"]}})
+
+
+def json_request(content: str):
+    try:
+        request = json.loads(content)
+    except ValueError:
+        return None
+    return request if isinstance(request, dict) and "questions" in request else None
+
+
+def fake_completion(model: str, messages: List[dict]) -> dict:
+    """A chat completion body, as the API returns it, for messages."""
+    prompt = "\n".join(message["content"] for message in messages)
+    context = prompt.replace("=== TEXT START ===", "Context:", 1)
+    request = json_request(messages[-1]["content"])
+    content = fake_json_answers(context, request) if request else fake_answer(context)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": (len(prompt) + len(content)) // 4,
+        },
+    }
+
+
+def namespace(value):
+    """Nested dicts as attribute objects, the way the SDK exposes responses."""
+    if isinstance(value, dict):
+        return SimpleNamespace(**{key: namespace(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [namespace(item) for item in value]
+    return value
+
+
+class FakeOpenAIClient:
+    """
+    Stand-in for openai.OpenAI() exposing chat.completions.create, with a
+    response shaped like the real one (choices[0].message.content, usage).
+    When the last message is a JSON {"questions": [...]} request, it answers
+    with JSON keyed by question id, like chat.py's batched mode asks for.
+
+    files.create / files.content and batches.create / batches.retrieve accept
+    and fulfil Batch API input files, kept in OFFLINE_BATCH_DIR. A batch moves
+    one status further on every retrieve (validating, in_progress, completed).
+    """
+
+    def __init__(self, latency: float = OFFLINE_LATENCY, batch_dir: str = OFFLINE_BATCH_DIR):
+        self.latency = latency
+        self.batch_dir = batch_dir
+        self.api_key = "offline"
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.files = SimpleNamespace(create=self._file_create, content=self._file_content)
+        self.batches = SimpleNamespace(create=self._batch_create, retrieve=self._batch_retrieve)
+
+    def with_options(self, **kwargs: Any) -> "FakeOpenAIClient":
+        """Like OpenAI.with_options (chat.py turns retries off); options do not matter offline."""
+        return self
+
+    def _create(self, model: str, messages: List[dict], **kwargs: Any):
+        sleep_latency(self.latency)
+        return namespace(fake_completion(model, messages))
+
+    def _path(self, object_id: str) -> str:
+        os.makedirs(self.batch_dir, exist_ok=True)
+        return os.path.join(self.batch_dir, object_id)
+
+    def _file_create(self, file, purpose: str):
+        file_id = f"file-{uuid.uuid4().hex[:12]}"
+        with open(self._path(file_id), "wb") as f:
+            f.write(file.read())
+        return SimpleNamespace(id=file_id, purpose=purpose)
+
+    def _file_content(self, file_id: str):
+        with open(self._path(file_id), "rb") as f:
+            content = f.read()
+        return SimpleNamespace(content=content, text=content.decode("utf-8"), read=lambda: content)
+
+    def _save_batch(self, batch: dict):
+        with open(self._path(batch["id"] + ".json"), "w", encoding="utf-8") as f:
+            json.dump(batch, f)
+
+    def _batch_create(self, input_file_id: str, endpoint: str, completion_window: str, **kwargs: Any):
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex[:12]}",
+            "object": "batch",
+            "endpoint": endpoint,
+            "input_file_id": input_file_id,
+            "completion_window": completion_window,
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        self._save_batch(batch)
+        return namespace(batch)
+
+    def _batch_retrieve(self, batch_id: str):
+        with open(self._path(batch_id + ".json"), "r", encoding="utf-8") as f:
+            batch = json.load(f)
+        if batch["status"] == "validating":
+            batch["status"] = "in_progress"
+        elif batch["status"] == "in_progress":
+            self._fulfil(batch)
+        self._save_batch(batch)
+        return namespace(batch)
+
+    def _fulfil(self, batch: dict):
+        sleep_latency(self.latency)
+        lines = self._file_content(batch["input_file_id"]).text.splitlines()
+        output = []
+        for line in lines:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            body = fake_completion(request["body"]["model"], request["body"]["messages"])
+            output.append(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": body},
+                "error": None,
+            }))
+        output_id = f"file-{uuid.uuid4().hex[:12]}"
+        with open(self._path(output_id), "w", encoding="utf-8") as f:
+            f.write("\n".join(output) + "\n")
+        batch.update(
+            status="completed",
+            output_file_id=output_id,
+            request_counts={"total": len(output), "completed": len(output), "failed": 0},
+        )
+
+
+def get_embeddings_backend(backend: str, model: str) -> tuple:
+    """Return (embeddings, model name used in cache keys) for the backend."""
+    if backend == "offline":
+        embeddings = HashingEmbeddings()
+        return embeddings, embeddings.model
+    from langchain.embeddings import OpenAIEmbeddings
+    return OpenAIEmbeddings(model=model), model
+
+
+def get_chat_model(backend: str, model_name: str, temperature: float = 1.0) -> LLM:
+    if backend == "offline":
+        return FakeChatModel()
+    from langchain.chat_models import ChatOpenAI
+    return ChatOpenAI(model_name=model_name, temperature=temperature)
+
+
+def get_openai_client(backend: str):
+    if backend == "offline":
+        return FakeOpenAIClient()
+    from openai import OpenAI
+    return OpenAI()
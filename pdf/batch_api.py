@@ -0,0 +1,166 @@
+"""
+OpenAI Batch API runs for chat.py and rag.py.
+
+Every pending (paper, question) request is written as one line of a JSONL
+batch file, uploaded and submitted; the batch is polled until it finishes
+and the results are handed back for ingestion into the answer store.
+Batches are billed at half price and do not count against the synchronous
+rate limits, which suits overnight full-corpus runs.
+
+The submitted batch is recorded in BATCH_DIR/<name>.json together with what
+each request is about, so an interrupted run resumes polling the same batch
+instead of paying for it twice. Requests of the resuming run that the old
+batch does not cover are submitted as a follow-up batch once it finishes.
+"""
+
+import json
+import os
+import time
+
+BATCH_DIR = "./docs/batches"
+ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+POLL_INTERVAL = 60
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def batch_request(custom_id: str, model: str, messages: list, **params) -> dict:
+    """One line of the batch input file; params (e.g. response_format) go into the request body."""
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": ENDPOINT,
+        "body": {"model": model, "messages": messages, **params},
+    }
+
+
+def state_path(name: str, batch_dir: str = BATCH_DIR) -> str:
+    return os.path.join(batch_dir, f"{name}.json")
+
+
+def load_state(name: str, batch_dir: str = BATCH_DIR):
+    path = state_path(name, batch_dir)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(name: str, state: dict, batch_dir: str = BATCH_DIR):
+    path = state_path(name, batch_dir)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def submit_batch(client, name: str, requests: list, metadata: dict, batch_dir: str = BATCH_DIR,
+                 earlier: list = ()) -> dict:
+    """
+    Write requests to BATCH_DIR/<name>.jsonl, upload it and create the batch.
+    metadata maps each custom_id to what the caller needs for ingestion.
+    earlier lists finished batches of this run whose results are not ingested yet.
+    """
+    os.makedirs(batch_dir, exist_ok=True)
+    input_path = os.path.join(batch_dir, f"{name}.jsonl")
+    with open(input_path, "w", encoding="utf-8") as f:
+        for request in requests:
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+    with open(input_path, "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=input_file.id, endpoint=ENDPOINT, completion_window=COMPLETION_WINDOW,
+    )
+    state = {
+        "batch_id": batch.id,
+        "input_file_id": input_file.id,
+        "input_path": input_path,
+        "submitted_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "requests": metadata,
+        "earlier": list(earlier),
+    }
+    save_state(name, state, batch_dir)
+    print(f"Submitted batch {batch.id} with {len(requests)} requests ({input_path})")
+    return state
+
+
+def wait_for_batch(client, batch_id: str, poll_interval: float = POLL_INTERVAL):
+    """Poll until the batch reaches a terminal status and return it."""
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        print(f"Batch {batch_id}: {batch.status} "
+              f"({counts.completed}/{counts.total} done, {counts.failed} failed)")
+        if batch.status in TERMINAL_STATUSES:
+            return batch
+        time.sleep(poll_interval)
+
+
+def _file_lines(client, file_id: str) -> list:
+    if not file_id:
+        return []
+    return [json.loads(line) for line in client.files.content(file_id).text.splitlines() if line.strip()]
+
+
+def batch_results(client, batch) -> dict:
+    """
+    {custom_id: {"content", "usage", "error"}} from the batch's output and
+    error files. content is None for failed requests.
+    """
+    results = {}
+    for line in _file_lines(client, batch.output_file_id) + _file_lines(client, batch.error_file_id):
+        response = line.get("response") or {}
+        body = response.get("body") or {}
+        if response.get("status_code") == 200 and body.get("choices"):
+            results[line["custom_id"]] = {
+                "content": body["choices"][0]["message"]["content"],
+                "usage": body.get("usage") or {},
+                "error": None,
+            }
+        else:
+            error = line.get("error") or body.get("error") or f"status {response.get('status_code')}"
+            results[line["custom_id"]] = {"content": None, "usage": {}, "error": json.dumps(error)}
+    return results
+
+
+def run_batch(client, name: str, requests: list, metadata: dict,
+              poll_interval: float = POLL_INTERVAL, batch_dir: str = BATCH_DIR) -> tuple:
+    """
+    Submit requests as batch <name>, or resume the batch already submitted
+    under that name, and wait for it. Requests the resumed batch does not
+    cover are then submitted and waited for as well. Returns (results,
+    metadata) of every batch that ran; call finish_batch(name) once the
+    results are stored.
+    """
+    state = load_state(name, batch_dir)
+    if state is not None:
+        print(f"Resuming batch {state['batch_id']} submitted at {state['submitted_at']}")
+    elif not requests:
+        return {}, {}
+    else:
+        state = submit_batch(client, name, requests, metadata, batch_dir)
+
+    results, ran = {}, {}
+    # Batches that finished before an interrupted follow-up batch
+    for earlier in state.get("earlier", []):
+        results.update(batch_results(client, client.batches.retrieve(earlier["batch_id"])))
+        ran.update(earlier["requests"])
+    while True:
+        batch = wait_for_batch(client, state["batch_id"], poll_interval)
+        if batch.status != "completed":
+            print(f"Batch {state['batch_id']} ended as {batch.status}, ingesting what finished")
+        results.update(batch_results(client, batch))
+        ran.update(state["requests"])
+        leftover = [request for request in requests if request["custom_id"] not in ran]
+        if not leftover:
+            return results, ran
+        print(f"Warning: {len(leftover)} requests of this run are not in the resumed batch, submitting them now")
+        earlier = state.get("earlier", []) + [{"batch_id": state["batch_id"], "requests": state["requests"]}]
+        state = submit_batch(client, name, leftover, {request["custom_id"]: metadata[request["custom_id"]]
+                                                      for request in leftover}, batch_dir, earlier)
+
+
+def finish_batch(name: str, batch_dir: str = BATCH_DIR):
+    """Forget the batch after its results are ingested; the next run submits a new one."""
+    path = state_path(name, batch_dir)
+    if os.path.isfile(path):
+        os.replace(path, path[:-len(".json")] + f".done-{time.strftime('%Y%m%d-%H%M%S')}.json")
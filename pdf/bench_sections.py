@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+"""
+Micro-benchmark: single-pass section stripper vs. the old three-scan version.
+
+Usage: python3 pdf/bench_sections.py [pages ...]
+"""
+
+import random
+import re
+import sys
+import timeit
+
+from sections import remove_unwanted_sections
+
+
+def remove_unwanted_sections_legacy(text: str) -> str:
+    """The previous implementation: one search + string rebuild per section type."""
+    related_pattern = re.compile(
+        r'^(?:\d+\s*[\.\)]\s*)?(?:related\s+works?)\b.*$',
+        re.IGNORECASE | re.MULTILINE
+    )
+    refs_pattern = re.compile(
+        r'^(?:\d+\s*[\.\)]\s*)?(?:references|bibliography)\b.*$',
+        re.IGNORECASE | re.MULTILINE
+    )
+    litreview_pattern = re.compile(
+        r'^(?:\d+\s*[\.\)]\s*)?(?:literature\s+review)\b.*$',
+        re.IGNORECASE | re.MULTILINE
+    )
+    generic_heading = re.compile(
+        r'^(?!Figure|Table)(?:\d+\s*[\.\)]\s*)?[A-Z][A-Za-z0-9\-\s\:,\&]{0,50}$',
+        re.MULTILINE
+    )
+
+    cleaned_text = text
+    for pattern in (related_pattern, litreview_pattern, refs_pattern):
+        match = pattern.search(cleaned_text)
+        if match:
+            start_idx = match.start()
+            next_header = generic_heading.search(cleaned_text, match.end())
+            end_idx = next_header.start() if next_header else len(cleaned_text)
+            cleaned_text = cleaned_text[:start_idx] + cleaned_text[end_idx:]
+    return cleaned_text
+
+
+WORDS = "model student knowledge tracing data learning sequence prediction skill the of and to in".split()
+
+
+def synthetic_paper(pages: int, seed: int = 0) -> str:
+    """A paper with numbered sections, one related-work section and references at the end."""
+    rng = random.Random(seed)
+    titles = ["Introduction", "Related Work", "Methods", "Results", "Discussion", "Conclusion"]
+    lines_per_page = 45
+    per_section = max(1, pages * lines_per_page // len(titles))
+    out = []
+    for n, title in enumerate(titles, start=1):
+        out.append(f"{n}. {title}")
+        for _ in range(per_section):
+            out.append(" ".join(rng.choice(WORDS) for _ in range(14)) + ".")
+    out.append("References")
+    for n in range(pages * 3):
+        out.append(f"[{n}] author, et al. a paper about {rng.choice(WORDS)}.")
+    return "\n".join(out)
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [20, 200, 2000]
+    print(f"{'pages':>6} {'chars':>10} {'legacy ms':>10} {'single ms':>10} {'speedup':>8}  same")
+    for pages in sizes:
+        text = synthetic_paper(pages)
+        number = max(1, 200 // pages)
+        legacy = min(timeit.repeat(lambda: remove_unwanted_sections_legacy(text), number=number, repeat=3)) / number
+        single = min(timeit.repeat(lambda: remove_unwanted_sections(text), number=number, repeat=3)) / number
+        same = remove_unwanted_sections_legacy(text) == remove_unwanted_sections(text)
+        print(f"{pages:>6} {len(text):>10} {legacy * 1000:>10.2f} {single * 1000:>10.2f} {legacy / single:>7.1f}x  {same}")
+
+
+if __name__ == "__main__":
+    main()
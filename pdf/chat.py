@@ -1,11 +1,23 @@
+import argparse
+import json
 import os
-from openai import OpenAI
+import time
+from answer_store import AnswerStore, text_hash
+from backends import DEFAULT_BACKEND, get_openai_client
+from telemetry import MAX_RETRIES, Telemetry, is_retryable, retry_delay
+from batch_api import POLL_INTERVAL, batch_request, finish_batch, run_batch
+from llm_cache import CACHE_MODES, DEFAULT_CACHE_MODE, ResponseCache, cache_key
+from sections import read_sections
 
-openai = OpenAI()
+# LITREVIEW_BACKEND=offline swaps in a fake client, no network or key needed
+openai = get_openai_client(DEFAULT_BACKEND)
 
 if not openai.api_key:
     raise ValueError("The OPENAI_API_KEY environment variable is not set.")
 
+# Completions are retried in complete(), where the retries are counted for telemetry
+completions = openai.with_options(max_retries=0).chat.completions
+
 questions = [
     # {
     #     "id": 1,
@@ -63,12 +75,34 @@ questions = [
 
 FOLDER_PATH = "./docs/papers"
 
-def ask_question_about_text(file_content: str, question: str) -> str:
+# MODEL = "o1-2024-12-17"
+MODEL = "o1-mini-2024-09-12"
+# Answers and telemetry keep offline runs apart from real ones
+RECORDED_MODEL = MODEL if DEFAULT_BACKEND == "openai" else f"{DEFAULT_BACKEND}:{MODEL}"
+
+# Models that reject response_format; for them the prompt alone asks for JSON
+NO_JSON_MODE_MODELS = ("o1-mini", "o1-preview")
+
+
+def json_mode(model: str) -> dict:
     """
-    Send a prompt to OpenAI's model, telling it to answer ONLY based on the provided text.
-    Return the answer string.
+    The params asking model for a JSON object (the instructions below say so,
+    as JSON mode requires), or none for models without JSON mode.
     """
-    system_message = (
+    if model.startswith(NO_JSON_MODE_MODELS):
+        return {}
+    return {"response_format": {"type": "json_object"}}
+
+
+BATCH_INSTRUCTIONS = (
+    "Answer every question in the JSON below about the text above, each one on its own. "
+    "Reply with a single JSON object and nothing else, in the form "
+    '{"answers": {"<question id>": "<answer as plain text>"}}, with one entry per question id.'
+)
+
+
+def context_message(file_content: str) -> str:
+    return (
         "You are a helpful assistant strictly limited to the context provided. "
         "Use only the text below to answer the question. "
         "If the text does not provide enough information, say you don't know.\n\n"
@@ -77,48 +111,247 @@ def ask_question_about_text(file_content: str, question: str) -> str:
         f"=== TEXT START ===\n{file_content}\n=== TEXT END ==="
     )
 
-    user_message = question
 
-    response = openai.chat.completions.create(
-        # model="o1-2024-12-17",
-        model="o1-mini-2024-09-12",
-        messages=[
-            {"role": "user", "content": system_message},
-            {"role": "user", "content": user_message},
-        ]
-    )
+def complete(messages: list, telemetry: Telemetry = None, paper: str = None, question_id=None,
+             cache: ResponseCache = None, params: dict = None) -> str:
+    """
+    One chat completion, answered from the response cache when given and
+    possible, otherwise recorded in telemetry when given. params (e.g.
+    json_mode(MODEL)) are passed to the API and are part of the cache key.
+    Returns the reply text.
+    """
+    params = params or {}
+    key = cache_key(RECORDED_MODEL, messages, params)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    started = time.perf_counter()
+    retries = 0
+    while True:
+        try:
+            response = completions.create(model=MODEL, messages=messages, **params)
+            break
+        except Exception as e:
+            if retries < MAX_RETRIES and is_retryable(e):
+                retries += 1
+                time.sleep(retry_delay(retries))
+                continue
+            if telemetry is not None:
+                telemetry.record("llm", RECORDED_MODEL, time.perf_counter() - started, paper=paper,
+                                 question_id=question_id, retries=retries, error=str(e))
+            raise
+    if telemetry is not None:
+        telemetry.record("llm", RECORDED_MODEL, time.perf_counter() - started, retries=retries,
+                         prompt_tokens=response.usage.prompt_tokens,
+                         completion_tokens=response.usage.completion_tokens,
+                         paper=paper, question_id=question_id)
+
+    content = response.choices[0].message.content
+    if cache is not None:
+        cache.put(key, RECORDED_MODEL, content, response.usage.prompt_tokens, response.usage.completion_tokens)
+    return content
+
 
-    answer = response.choices[0].message.content
+def ask_question_about_text(file_content: str, question: str, telemetry: Telemetry = None,
+                            paper: str = None, question_id=None, cache: ResponseCache = None) -> str:
+    """
+    Send a prompt to OpenAI's model, telling it to answer ONLY based on the provided text.
+    Return the answer string. The call is recorded in telemetry when given.
+    """
+    answer = complete(question_messages(file_content, question), telemetry, paper, question_id, cache)
     return answer.strip()
 
+
+def question_messages(file_content: str, question: str) -> list:
+    return [
+        {"role": "user", "content": context_message(file_content)},
+        {"role": "user", "content": question},
+    ]
+
+
+def questions_messages(file_content: str, questions: list) -> list:
+    """The paper once, then all questions as a JSON request."""
+    request = {"questions": [{"id": q["id"], "question": q["question"]} for q in questions]}
+    return [
+        {"role": "user", "content": context_message(file_content) + "\n\n" + BATCH_INSTRUCTIONS},
+        {"role": "user", "content": json.dumps(request, ensure_ascii=False)},
+    ]
+
+
+def parse_answers(content: str, questions: list) -> dict:
+    """
+    {question id: answer} from a batched reply, tolerating text or code fences
+    around the JSON. Questions without a non-empty answer are left out.
+    """
+    start, end = content.find("{"), content.rfind("}")
+    if start < 0 or end < start:
+        return {}
+    try:
+        data = json.loads(content[start:end + 1])
+    except ValueError:
+        return {}
+    answers = data.get("answers", data) if isinstance(data, dict) else None
+    if not isinstance(answers, dict):
+        return {}
+    parsed = {}
+    for q in questions:
+        answer = answers.get(str(q["id"]))
+        if isinstance(answer, str) and answer.strip():
+            parsed[q["id"]] = answer.strip()
+    return parsed
+
+
+def ask_questions_about_text(file_content: str, questions: list, telemetry: Telemetry = None,
+                             paper: str = None, cache: ResponseCache = None) -> dict:
+    """
+    Send the paper once with all questions and ask for JSON answers keyed by
+    question id, in JSON mode. Returns {question id: answer} for the answers that parsed.
+    """
+    content = complete(questions_messages(file_content, questions), telemetry, paper, cache=cache, params=json_mode(MODEL))
+    return parse_answers(content, questions)
+
+
+def store_batch_answers(store: AnswerStore, request: dict, content: str) -> int:
+    """Store the answers in one batch reply. Returns how many questions got none."""
+    if content is None:
+        answers = {}
+    elif request["json"]:
+        answers = parse_answers(content, request["questions"])
+    else:
+        answers = {request["questions"][0]["id"]: content.strip()}
+    for q in request["questions"]:
+        if q["id"] in answers:
+            store.put(request["paper"], request["paper_hash"], q, RECORDED_MODEL, answers[q["id"]])
+    return sum(1 for q in request["questions"] if q["id"] not in answers)
+
+
+def ask_with_batch_api(store: AnswerStore, telemetry: Telemetry, per_question: bool = False,
+                       poll_interval: float = POLL_INTERVAL, cache: ResponseCache = None, sections=None):
+    """
+    Ask every pending question of every paper through one Batch API batch
+    and store the answers. Same granularity as the synchronous mode: one
+    JSON request per paper, or one request per question with per_question.
+    Requests in the response cache are answered from it and left out of the batch.
+    With sections, only those sections of each paper are sent.
+    """
+    requests, metadata = [], {}
+    unanswered = 0
+    for filename in sorted(os.listdir(FOLDER_PATH)):
+        if not filename.endswith(".txt"):
+            continue
+        file_content = read_sections(os.path.join(FOLDER_PATH, filename), sections)
+        paper_hash = text_hash(file_content)
+        pending = store.pending(paper_hash, questions, RECORDED_MODEL)
+        if len(pending) > 1 and not per_question:
+            groups = [("all", pending, questions_messages(file_content, pending))]
+        else:
+            groups = [(q["id"], [q], question_messages(file_content, q["question"])) for q in pending]
+        for group, asked, messages in groups:
+            params = json_mode(MODEL) if group == "all" else {}
+            request = {"paper": filename, "paper_hash": paper_hash, "questions": asked,
+                       "json": group == "all", "cache_key": cache_key(RECORDED_MODEL, messages, params)}
+            cached = cache.get(request["cache_key"]) if cache is not None else None
+            if cached is not None:
+                unanswered += store_batch_answers(store, request, cached)
+                continue
+            custom_id = f"{filename}#{group}"
+            requests.append(batch_request(custom_id, MODEL, messages, **params))
+            metadata[custom_id] = request
+
+    results, metadata = run_batch(openai, "chat", requests, metadata, poll_interval)
+    for custom_id, request in metadata.items():
+        result = results.get(custom_id) or {"content": None, "usage": {}, "error": "no result"}
+        telemetry.record("batch", RECORDED_MODEL, 0.0,
+                         prompt_tokens=result["usage"].get("prompt_tokens", 0),
+                         completion_tokens=result["usage"].get("completion_tokens", 0),
+                         paper=request["paper"], error=result["error"])
+        unanswered += store_batch_answers(store, request, result["content"])
+        if cache is not None and result["content"] is not None:
+            cache.put(request["cache_key"], RECORDED_MODEL, result["content"],
+                      result["usage"].get("prompt_tokens", 0), result["usage"].get("completion_tokens", 0))
+    if metadata:
+        finish_batch("chat")
+    if unanswered:
+        print(f"{unanswered} questions got no usable answer from the batch, run again to ask them")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ask questions about every paper in " + FOLDER_PATH)
+    parser.add_argument("--per-question", action="store_true",
+                        help="one call per question instead of one call per paper with all questions")
+    parser.add_argument("--llm-cache", choices=CACHE_MODES, default=DEFAULT_CACHE_MODE,
+                        help="use cached responses, refresh them, or bypass the cache "
+                             f"(default: {DEFAULT_CACHE_MODE}, from LITREVIEW_LLM_CACHE)")
+    parser.add_argument("--batch", action="store_true",
+                        help="send everything pending as one Batch API batch, wait for it and ingest the answers")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL,
+                        help=f"seconds between batch status checks (default: {POLL_INTERVAL})")
+    parser.add_argument("--section", dest="sections", action="append", metavar="WORD",
+                        help="only use the sections whose title contains WORD (repeatable, e.g. --section method "
+                             "--section result), read via the .sections.json index mass_reader.py writes")
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
+    # Answers are stored as they arrive, a rerun only asks what is missing
+    store = AnswerStore()
+    telemetry = Telemetry("chat.py")
+    cache = ResponseCache(args.llm_cache)
+    model = RECORDED_MODEL
+
+    if args.batch:
+        ask_with_batch_api(store, telemetry, args.per_question, args.poll_interval, cache, args.sections)
+
     for filename in os.listdir(FOLDER_PATH):
         if filename.endswith(".txt"):
             txt_path = os.path.join(FOLDER_PATH, filename)
             
-            # Read the .txt file content
-            with open(txt_path, "r", encoding="utf-8") as f:
-                file_content = f.read()
+            # Read the .txt file content (or just the requested sections)
+            file_content = read_sections(txt_path, args.sections)
+            paper_hash = text_hash(file_content)
             
             # Prepare the output filename (replace .txt with .md)
             base_name = os.path.splitext(filename)[0]  # e.g. "10.1016_j.eswa.2023.123128"
             md_filename = base_name + ".md"
             md_path = os.path.join(FOLDER_PATH, md_filename)
 
-            for q in questions:
-                answer = ask_question_about_text(file_content, q["question"])
-                
-                md_content = (
-                    f"## Question {q['id']}\n"
-                    f"**{q['question']}**\n"
-                    f"{answer}\n\n"
-                )
-                
-                with open(md_path, "a", encoding="utf-8") as md_file:
-                    md_file.write(md_content)
+            # In batch mode everything was asked above, only render what came back
+            pending = [] if args.batch else store.pending(paper_hash, questions, model)
+            if len(pending) > 1 and not args.per_question:
+                # The paper is sent once for all questions
+                started = time.perf_counter()
+                try:
+                    answers = ask_questions_about_text(file_content, pending, telemetry, filename, cache)
+                except Exception as e:
+                    # The per-question calls below are the fallback for a failed call too
+                    print(f"'{filename}': asking all questions at once failed ({e})")
+                    answers = {}
+                seconds = (time.perf_counter() - started) / len(pending)
+                for q in pending:
+                    if q["id"] in answers:
+                        store.put(filename, paper_hash, q, model, answers[q["id"]], seconds=seconds)
+                pending = [q for q in pending if q["id"] not in answers]
+                if pending:
+                    print(f"'{filename}': no parsable answer to {len(pending)} questions, asking them one by one")
+
+            for q in pending:
+                started = time.perf_counter()
+                answer = ask_question_about_text(file_content, q["question"], telemetry, filename, q["id"], cache)
+                store.put(filename, paper_hash, q, model, answer, seconds=time.perf_counter() - started)
+
+            # Render the Markdown from the store, so reruns never duplicate sections
+            with open(md_path, "w", encoding="utf-8") as md_file:
+                md_file.write(store.render_markdown(paper_hash, questions, model))
             
             print(f"Processed '{filename}' -> '{md_filename}'")
 
+    store.close()
+    print(cache.stats())
+    cache.close()
+    print(telemetry.summary())
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,101 @@
+"""
+Token-budgeted context for the "stuff" QA chain.
+
+Instead of pasting all k retrieved chunks into the prompt, the packer
+- drops tail chunks whose distance is much worse than the best one,
+- adds chunks in relevance order while the context fits the token budget
+  (counted with the model's tokenizer),
+- merges chunks of the same paper that overlap or touch, using the
+  start_index the splitter records, so overlapping text is sent once.
+The packed chunks come out per paper in reading order, each still carrying
+its source, so citations keep working.
+"""
+
+from typing import List, Tuple
+
+from langchain.schema import Document
+
+from telemetry import count_tokens, get_encoding
+
+# Tokens of retrieved text per question (the prompt template and question come on top)
+CONTEXT_TOKEN_BUDGET = 3000
+# Chunks farther than this from the best chunk (squared L2, as FAISS reports) are dropped
+MAX_DISTANCE_GAP = 0.3
+# Chunks this many characters apart or closer count as adjacent
+ADJACENT_GAP = 2
+
+
+def _span(doc: Document):
+    start = doc.metadata.get("start_index")
+    if start is None:
+        return None
+    return start, start + len(doc.page_content)
+
+
+def merge_chunks(docs: List[Document]) -> List[Document]:
+    """
+    Merge overlapping and adjacent chunks of the same source into one document
+    each, in reading order. Chunks without start_index are kept as they are.
+    """
+    merged = []
+    positioned = sorted((doc for doc in docs if _span(doc)), key=lambda doc: _span(doc)[0])
+    for doc in positioned:
+        start, end = _span(doc)
+        if merged:
+            last = merged[-1]
+            _, last_end = _span(last)
+            if start <= last_end + ADJACENT_GAP:
+                if end > last_end:
+                    if start >= last_end:
+                        # The splitter stripped the separator between them; keep offsets exact
+                        text = last.page_content + "\n" * (start - last_end) + doc.page_content
+                    else:
+                        text = last.page_content + doc.page_content[last_end - start:]
+                    merged[-1] = Document(page_content=text, metadata=dict(last.metadata))
+                continue
+        merged.append(Document(page_content=doc.page_content, metadata=dict(doc.metadata)))
+    return merged + [doc for doc in docs if not _span(doc)]
+
+
+def _packed(selected: List[Document], order: List[str]) -> List[Document]:
+    """Merge per source, sources in the order their best chunk was selected."""
+    by_source = {}
+    for doc in selected:
+        by_source.setdefault(doc.metadata.get("source"), []).append(doc)
+    return [doc for source in order for doc in merge_chunks(by_source[source])]
+
+
+def _tokens(docs: List[Document], model: str) -> int:
+    # The stuff chain joins documents with a blank line
+    return count_tokens("\n\n".join(doc.page_content for doc in docs), model)
+
+
+def truncate_to_tokens(text: str, budget: int, model: str) -> str:
+    encoding = get_encoding(model)
+    if encoding is None:
+        return text[:budget * 4]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:budget])
+
+
+def pack_context(scored_docs: List[Tuple[Document, float]], budget: int = CONTEXT_TOKEN_BUDGET,
+                 model: str = "gpt-4o", max_distance_gap: float = MAX_DISTANCE_GAP) -> List[Document]:
+    """
+    Pack (document, distance) pairs, nearest first, into at most budget
+    tokens. The best chunk is always kept, truncated when it alone is too long.
+    """
+    if not scored_docs:
+        return []
+    best = scored_docs[0][1]
+    candidates = [doc for doc, distance in scored_docs if distance <= best + max_distance_gap]
+
+    selected, order = [], []
+    for doc in candidates:
+        source = doc.metadata.get("source")
+        trial_order = order if source in order else order + [source]
+        if _tokens(_packed(selected + [doc], trial_order), model) <= budget:
+            selected.append(doc)
+            order = trial_order
+        elif not selected:
+            text = truncate_to_tokens(doc.page_content, budget, model)
+            return [Document(page_content=text, metadata=dict(doc.metadata))]
+    return _packed(selected, order)
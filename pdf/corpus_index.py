@@ -0,0 +1,180 @@
+"""
+One persistent FAISS index over every paper in docs/papers.
+
+Each chunk carries the paper's metadata (source file, DOI, year, Zotero
+collections). Papers are added, replaced or removed one at a time, so a
+changed corpus never needs a full rebuild. The same index answers per-paper
+questions (filter on source) and questions across the whole literature
+review (no filter, or filter on DOI / year / collection).
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict, List
+
+import numpy as np
+from langchain.docstore.document import Document as LC_Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores import FAISS
+
+from manifest import MANIFEST_PATH, load_manifest, sanitize_filename
+
+CORPUS_INDEX_DIR = "./docs/cache/corpus"
+
+
+def paper_metadata_from_manifest(manifest_path: str = MANIFEST_PATH) -> Dict[str, dict]:
+    """Map each paper's .txt filename to the DOI, year and collections mass_reader recorded."""
+    metadata = {}
+    for doi, entry in load_manifest(manifest_path).items():
+        metadata[f"{sanitize_filename(doi)}.txt"] = {
+            "doi": doi,
+            "year": entry.get("year"),
+            "collections": entry.get("collections", []),
+        }
+    return metadata
+
+
+def matches(metadata: dict, filters: dict) -> bool:
+    """
+    True when every filter matches. A filter value may be a single value or a
+    list of accepted values; list-valued metadata (collections) matches when
+    any of its values is accepted.
+    """
+    for key, wanted in filters.items():
+        wanted = wanted if isinstance(wanted, (list, tuple, set)) else [wanted]
+        value = metadata.get(key)
+        values = value if isinstance(value, list) else [value]
+        if not any(v in wanted for v in values):
+            return False
+    return True
+
+
+class CorpusIndex:
+    """
+    papers.json next to the FAISS files records, per paper, the hash of its
+    text + chunk settings, the docstore ids of its chunks and its metadata.
+    """
+
+    def __init__(self, embeddings: Embeddings, splitter, settings: dict, path: str = CORPUS_INDEX_DIR):
+        self.embeddings = embeddings
+        self.splitter = splitter
+        self.settings = json.dumps(settings, sort_keys=True)
+        self.path = path
+        self.papers_path = os.path.join(path, "papers.json")
+        self.papers = {}
+        self.vectorstore = None
+        # Set by every change to the vectors or papers.json, cleared by save()
+        self.changed = False
+        if os.path.isfile(os.path.join(path, "index.faiss")):
+            self.vectorstore = FAISS.load_local(path, embeddings)
+            with open(self.papers_path, "r", encoding="utf-8") as f:
+                self.papers = json.load(f)
+
+    def paper_hash(self, text: str) -> str:
+        return hashlib.sha256(f"{self.settings}\0{text}".encode("utf-8")).hexdigest()
+
+    def add_paper(self, filename: str, text: str, metadata: dict = None) -> bool:
+        """Index one paper, replacing an older version. Returns False when it was up to date."""
+        text_hash = self.paper_hash(text)
+        metadata = dict(metadata or {}, source=filename)
+        entry = self.papers.get(filename)
+        if entry and entry["hash"] == text_hash:
+            if entry["metadata"] != metadata:
+                self._set_metadata(filename, metadata)
+            return False
+        if entry:
+            self.remove_paper(filename)
+
+        raw_doc = LC_Document(page_content=text, metadata=metadata)
+        docs = self.splitter.split_documents([raw_doc])
+        ids = [f"{filename}#{i}" for i in range(len(docs))]
+        if docs:
+            if self.vectorstore is None:
+                self.vectorstore = FAISS.from_documents(docs, self.embeddings, ids=ids)
+            else:
+                self.vectorstore.add_documents(docs, ids=ids)
+        self.papers[filename] = {"hash": text_hash, "ids": ids, "metadata": metadata}
+        self.changed = True
+        return True
+
+    def remove_paper(self, filename: str) -> bool:
+        entry = self.papers.pop(filename, None)
+        if not entry:
+            return False
+        if entry["ids"]:
+            self.vectorstore.delete(entry["ids"])
+        self.changed = True
+        return True
+
+    def _set_metadata(self, filename: str, metadata: dict):
+        """Metadata (e.g. a new collection) changed but the text did not: no re-embedding."""
+        entry = self.papers[filename]
+        for doc_id in entry["ids"]:
+            self.vectorstore.docstore.search(doc_id).metadata = dict(metadata)
+        entry["metadata"] = metadata
+        self.changed = True
+
+    def sync(self, folder: str, metadata: Dict[str, dict] = None) -> dict:
+        """
+        Bring the index in line with the .txt files in folder: add new and
+        changed papers, drop papers whose file is gone. Saves when anything changed.
+        """
+        metadata = metadata or {}
+        counts = {"added": 0, "removed": 0, "unchanged": 0}
+        filenames = sorted(f for f in os.listdir(folder) if f.endswith(".txt"))
+        for filename in set(self.papers) - set(filenames):
+            self.remove_paper(filename)
+            counts["removed"] += 1
+        for filename in filenames:
+            with open(os.path.join(folder, filename), "r", encoding="utf-8") as f:
+                text = f.read()
+            if self.add_paper(filename, text, metadata.get(filename)):
+                counts["added"] += 1
+            else:
+                counts["unchanged"] += 1
+        if self.changed:
+            self.save()
+        return counts
+
+    def save(self):
+        if self.vectorstore is None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        self.vectorstore.save_local(self.path)
+        with open(self.papers_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.papers, f)
+        os.replace(self.papers_path + ".tmp", self.papers_path)
+        self.changed = False
+
+    def paper_chunks(self, filename: str) -> tuple:
+        """The paper's chunks and their vectors as one (n, dim) matrix."""
+        entry = self.papers.get(filename)
+        if not entry or not entry["ids"]:
+            return [], np.zeros((0, self.vectorstore.index.d if self.vectorstore else 0), dtype=np.float32)
+        positions = {doc_id: i for i, doc_id in self.vectorstore.index_to_docstore_id.items()}
+        rows = [positions[doc_id] for doc_id in entry["ids"]]
+        docs = [self.vectorstore.docstore.search(doc_id) for doc_id in entry["ids"]]
+        return docs, np.stack([self.vectorstore.index.reconstruct(row) for row in rows])
+
+    def search_with_scores(self, query: str, k: int, **filters) -> List[tuple]:
+        """
+        The k (chunk, distance) pairs nearest to query among those matching
+        filters. Fetches progressively more neighbours until k matches are found.
+        """
+        if self.vectorstore is None:
+            return []
+        total = self.vectorstore.index.ntotal
+        embedding = self.embeddings.embed_query(query)
+        fetch_k = k if not filters else k * 10
+        while True:
+            fetch_k = min(fetch_k, total)
+            found = self.vectorstore.similarity_search_with_score_by_vector(embedding, fetch_k)
+            scored = [(doc, float(score)) for doc, score in found if matches(doc.metadata, filters)]
+            if len(scored) >= k or fetch_k >= total:
+                return scored[:k]
+            fetch_k *= 4
+
+    def search(self, query: str, k: int, **filters) -> List[LC_Document]:
+        """The k chunks most similar to query among those matching filters."""
+        return [doc for doc, _ in self.search_with_scores(query, k, **filters)]
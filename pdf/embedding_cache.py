@@ -0,0 +1,172 @@
+"""
+Content-addressed embedding cache.
+
+Every text (chunk or question) is keyed by sha256(model + text). Vectors are
+appended as float32 rows to vectors.f32 and read back through a NumPy memmap;
+index.tsv maps each key to its row. One directory per embedding model.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import List
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from telemetry import Telemetry, count_tokens
+
+EMBEDDING_CACHE_DIR = "./docs/cache/embeddings"
+
+
+def text_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """Append-only on-disk store of float32 vectors addressed by key."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.vectors_path = os.path.join(path, "vectors.f32")
+        self.index_path = os.path.join(path, "index.tsv")
+        self.meta_path = os.path.join(path, "meta.json")
+        self.rows = {}
+        self.dim = None
+        self._vectors = None
+        # rag.py embeds from several threads: lookups, appends and the
+        # CachedEmbeddings counters are all done under this lock
+        self.lock = threading.RLock()
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.meta_path):
+            return
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            self.dim = json.load(f)["dim"]
+        # A vector only partly written (e.g. after a crash) is cut off, so the
+        # next append starts on a row boundary and every index line stays valid
+        stored = os.path.getsize(self.vectors_path) // (self.dim * 4) if os.path.isfile(self.vectors_path) else 0
+        if stored and os.path.getsize(self.vectors_path) != stored * self.dim * 4:
+            os.truncate(self.vectors_path, stored * self.dim * 4)
+        if os.path.isfile(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    key, _, row = line.rstrip("\n").partition("\t")
+                    if row and int(row) < stored:
+                        self.rows[key] = int(row)
+
+    def _matrix(self, rows_needed: int):
+        # Re-map when rows were appended since the file was last mapped
+        if self._vectors is None or len(self._vectors) < rows_needed:
+            count = os.path.getsize(self.vectors_path) // (self.dim * 4)
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(count, self.dim))
+        return self._vectors
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def get(self, keys: List[str]) -> np.ndarray:
+        with self.lock:
+            rows = [self.rows[key] for key in keys]
+            matrix = self._matrix(max(rows) + 1)
+        return np.asarray(matrix[rows])
+
+    def add(self, keys: List[str], vectors: List[List[float]]):
+        """Append the vectors of keys not stored yet (another thread may have added some meanwhile)."""
+        with self.lock:
+            new = {}
+            for key, vector in zip(keys, vectors):
+                if key not in self.rows and key not in new:
+                    new[key] = vector
+            if not new:
+                return
+            keys = list(new)
+            array = np.asarray(list(new.values()), dtype=np.float32)
+            if self.dim is None:
+                os.makedirs(self.path, exist_ok=True)
+                self.dim = array.shape[1]
+                with open(self.meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"dim": self.dim}, f)
+            start = os.path.getsize(self.vectors_path) // (self.dim * 4) if os.path.isfile(self.vectors_path) else 0
+            # Vectors first, then the index: an index line never points past the data
+            with open(self.vectors_path, "ab") as f:
+                f.write(array.tobytes())
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                for offset, key in enumerate(keys):
+                    f.write(f"{key}\t{start + offset}\n")
+                    self.rows[key] = start + offset
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that only sends texts it has never embedded with this
+    model to the underlying embeddings, in one batch, and counts hits/misses.
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str, cache_dir: str = EMBEDDING_CACHE_DIR,
+                 telemetry: Telemetry = None):
+        self.embeddings = embeddings
+        self.model = model
+        self.telemetry = telemetry
+        safe_model = model.replace("/", "_").replace("\\", "_").replace(":", "_")
+        self.store = EmbeddingStore(os.path.join(cache_dir, safe_model))
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [text_key(self.model, text) for text in texts]
+        missing = {}
+        with self.store.lock:
+            for key, text in zip(keys, texts):
+                if key not in self.store and key not in missing:
+                    missing[key] = text
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        # The API call runs unlocked; add() skips texts another thread stored meanwhile
+        if missing:
+            vectors = self._embed(list(missing.values()))
+            self.store.add(list(missing.keys()), vectors)
+        if not keys:
+            return []
+        return self.store.get(keys).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        key = text_key(self.model, text)
+        with self.store.lock:
+            cached = key in self.store
+            if cached:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not cached:
+            self.store.add([key], self._embed([text], query=True))
+        return self.store.get([key])[0].tolist()
+
+    def _embed(self, texts: List[str], query: bool = False) -> List[List[float]]:
+        """Call the underlying embeddings for cache misses, recording the call."""
+        started = time.perf_counter()
+        error = None
+        try:
+            if query:
+                return [self.embeddings.embed_query(texts[0])]
+            return self.embeddings.embed_documents(texts)
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            if self.telemetry is not None:
+                self.telemetry.record(
+                    "embedding", self.model, time.perf_counter() - started,
+                    prompt_tokens=sum(count_tokens(text, self.model) for text in texts), error=error,
+                )
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = 100.0 * self.hits / total if total else 0.0
+        return f"Embedding cache: {self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate), {len(self.store)} vectors stored"
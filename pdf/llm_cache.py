@@ -0,0 +1,150 @@
+"""
+Persistent cache of LLM responses for chat.py, rag.py and zotero/harvester.py.
+
+A response is keyed by sha256 of the model name, the full prompt (messages)
+and the generation parameters, so iterating on one question never re-bills
+the others. Entries live in one SQLite file under docs/, expire after
+LLM_CACHE_TTL_DAYS and the least recently used ones are evicted beyond
+LLM_CACHE_MAX_ENTRIES.
+
+Modes: "use" reads and writes, "refresh" ignores cached responses but stores
+the new ones, "bypass" neither reads nor writes. The default comes from the
+LITREVIEW_LLM_CACHE environment variable.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+LLM_CACHE_PATH = "./docs/cache/llm_responses.sqlite"
+LLM_CACHE_MAX_ENTRIES = 50000
+LLM_CACHE_TTL_DAYS = 180
+CACHE_MODES = ("use", "refresh", "bypass")
+DEFAULT_CACHE_MODE = os.environ.get("LITREVIEW_LLM_CACHE", "use")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key               TEXT PRIMARY KEY,
+    model             TEXT NOT NULL,
+    response          TEXT NOT NULL,
+    prompt_tokens     INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    created_at        REAL NOT NULL,
+    last_used         REAL NOT NULL
+)
+"""
+
+
+def cache_key(model: str, prompt, params: dict = None) -> str:
+    """prompt is a string or a list of chat messages."""
+    payload = json.dumps({"model": model, "prompt": prompt, "params": params or {}},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Thread-safe: rag.py looks up responses from its worker threads."""
+
+    def __init__(self, mode: str = DEFAULT_CACHE_MODE, path: str = LLM_CACHE_PATH,
+                 max_entries: int = LLM_CACHE_MAX_ENTRIES, ttl_days: float = LLM_CACHE_TTL_DAYS):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown LLM cache mode {mode!r}, expected one of {CACHE_MODES}")
+        self.mode = mode
+        self.max_entries = max_entries
+        self.ttl = ttl_days * 86400 if ttl_days else None
+        self.hits = 0
+        self.misses = 0
+        self.saved_prompt_tokens = 0
+        self.saved_completion_tokens = 0
+        self._lock = threading.Lock()
+        self.conn = None
+        if mode != "bypass":
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            self.conn.execute(SCHEMA)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+            self.conn.commit()
+            self._evict()
+
+    def get(self, key: str):
+        """The cached response text, or None on a miss (always in refresh and bypass mode)."""
+        if self.mode != "use":
+            with self._lock:
+                self.misses += 1
+            return None
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT response, prompt_tokens, completion_tokens, created_at FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is not None and self.ttl is not None and row[3] < now - self.ttl:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.hits += 1
+            self.saved_prompt_tokens += row[1]
+            self.saved_completion_tokens += row[2]
+        return row[0]
+
+    def put(self, key: str, model: str, response: str, prompt_tokens: int = 0, completion_tokens: int = 0):
+        if self.conn is None:
+            return
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, model, response, prompt_tokens, completion_tokens, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, response, prompt_tokens or 0, completion_tokens or 0, now, now),
+            )
+            # Keep the size bounded during long runs too, not only on open and close
+            if self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] > self.max_entries:
+                self._trim()
+            self.conn.commit()
+
+    def _trim(self):
+        """Delete the least recently used entries beyond max_entries; call with the lock held."""
+        self.conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def _evict(self):
+        """Drop expired entries, then the least recently used beyond max_entries."""
+        with self._lock:
+            if self.ttl is not None:
+                self.conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,))
+            self._trim()
+            self.conn.commit()
+
+    def __len__(self) -> int:
+        if self.conn is None:
+            return 0
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def stats(self) -> str:
+        return (
+            f"LLM response cache ({self.mode}): {self.hits} hits, {self.misses} misses, "
+            f"saved {self.saved_prompt_tokens} prompt + {self.saved_completion_tokens} completion tokens, "
+            f"{len(self)} responses stored"
+        )
+
+    def close(self):
+        if self.conn is not None:
+            self._evict()
+            self.conn.close()
+            self.conn = None
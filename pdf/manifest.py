@@ -0,0 +1,81 @@
+"""
+Build manifest for mass_reader.
+
+Records, per DOI, where the PDF came from (path, size, mtime, sha256), which
+extractor version produced the text and the sha256 of the written .txt file,
+plus the paper's year and Zotero collections for filtering in rag.py.
+A DOI whose source and extractor did not change and whose .txt is intact is
+skipped on the next build.
+"""
+
+import hashlib
+import json
+import os
+
+MANIFEST_PATH = "docs/manifest.json"
+
+
+def sanitize_filename(s: str) -> str:
+    """The DOI as used in .txt/.pdf filenames (and so in rag.py's source metadata)."""
+    return s.replace("/", "_").replace("\\", "_").replace(":", "_")
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(path: str = MANIFEST_PATH) -> dict:
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Warning: ignoring unreadable manifest {path}: {e}")
+        return {}
+
+
+def save_manifest(manifest: dict, path: str = MANIFEST_PATH):
+    """Write the manifest atomically, a crash never leaves it half-written."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def source_entry(source_path: str, previous: dict = None) -> dict:
+    """
+    Describe the source PDF. The content hash is only recomputed when
+    path, size or mtime differ from the previous entry.
+    """
+    st = os.stat(source_path)
+    entry = {
+        "source_path": source_path,
+        "source_size": st.st_size,
+        "source_mtime": st.st_mtime_ns,
+    }
+    if previous and all(previous.get(k) == v for k, v in entry.items()):
+        entry["source_sha256"] = previous.get("source_sha256")
+    else:
+        entry["source_sha256"] = file_sha256(source_path)
+    return entry
+
+
+def is_up_to_date(previous: dict, current: dict, extractor_version: str, txt_path: str) -> bool:
+    """
+    True when the recorded build used the same source content and extractor
+    version, and the .txt file on disk is still the one that build wrote.
+    """
+    if not previous:
+        return False
+    if previous.get("source_sha256") != current["source_sha256"]:
+        return False
+    if previous.get("extractor_version") != extractor_version:
+        return False
+    if not os.path.isfile(txt_path):
+        return False
+    return previous.get("txt_sha256") == file_sha256(txt_path)
@@ -1,121 +1,193 @@
 #!/usr/bin/env python3
 
+import argparse
 import os
-import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pymupdf  # or `import fitz` if you prefer PyMuPDF's canonical import
-import re
 
-INPUT_DOIS_FILE = "docs/in.txt"
+# zotero/ is not a package, make downloader.py importable from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "zotero"))
+from downloader import ZOTERO_DB_PATH, STAGE_MODES, resolve_pdf_paths, get_item_metadata, stage_pdf
+from zotero_db import ZoteroDB
+from sections import write_cleaned_text, save_section_index, section_index_path
+from manifest import MANIFEST_PATH, load_manifest, sanitize_filename, save_manifest, source_entry, is_up_to_date, file_sha256
 
+INPUT_DOIS_FILE = "docs/in.txt"
 
-def remove_unwanted_sections(text: str) -> str:
-    """Remove 'Related Work' / 'References' sections from text."""
-    related_pattern = re.compile(
-        r'^(?:\d+\s*[\.\)]\s*)?(?:related\s+works?)\b.*$',
-        re.IGNORECASE | re.MULTILINE
-    )
-    refs_pattern = re.compile(
-        r'^(?:\d+\s*[\.\)]\s*)?(?:references|bibliography)\b.*$',
-        re.IGNORECASE | re.MULTILINE
-    )
-    litreview_pattern = re.compile(
-        r'^(?:\d+\s*[\.\)]\s*)?(?:literature\s+review)\b.*$',
-        re.IGNORECASE | re.MULTILINE
-    )
-    generic_heading = re.compile(
-        r'^(?!Figure|Table)(?:\d+\s*[\.\)]\s*)?[A-Z][A-Za-z0-9\-\s\:,\&]{0,50}$',
-        re.MULTILINE
-    )
-
-    cleaned_text = text
-
-    # Remove "Related Work" section if present
-    match = related_pattern.search(cleaned_text)
-    if match:
-        start_idx = match.start()
-        next_header = generic_heading.search(cleaned_text, match.end())
-        if next_header:
-            end_idx = next_header.start()
-        else:
-            end_idx = len(cleaned_text)
-        cleaned_text = cleaned_text[:start_idx] + cleaned_text[end_idx:]
-        
-    # Remove "Literature Review" section if present
-    match = litreview_pattern.search(cleaned_text)
-    if match:
-        start_idx = match.start()
-        next_header = generic_heading.search(cleaned_text, match.end())
-        if next_header:
-            end_idx = next_header.start()
+# Bump whenever extraction or the section rules in sections.py change,
+# so the manifest knows every paper has to be rebuilt.
+EXTRACTOR_VERSION = "3"
+
+# The manifest is saved after this many extracted papers (and at the end),
+# so an interrupted build keeps what it finished
+MANIFEST_SAVE_EVERY = 25
+
+
+def iter_page_texts(pdf_path: str):
+    """Yield the text of each page, with the same page-break marker between pages as before."""
+    doc = pymupdf.open(pdf_path)
+    try:
+        for page_number, page in enumerate(doc):
+            if page_number:
+                yield "\n\f\n"
+            # get_text() returns a string
+            yield page.get_text()
+    finally:
+        doc.close()
+
+
+def extract_pdf_to_text(doi: str, pdf_path: str, txt_path: str):
+    """
+    Extract the text of one PDF, clean it and write it to txt_path.
+    Pages are streamed through the section stripper straight into the file,
+    so memory does not grow with the size of the document. The section index
+    (titles, levels, pages, byte offsets) goes to a .sections.json sidecar.
+    Returns (doi, error) where error is None on success, so it can run in a
+    worker process and report back without printing.
+    """
+    part_path = txt_path + ".part"
+    try:
+        # 3-4. Extract pages one by one and remove unwanted sections as they pass
+        # 5. Write the cleaned text to file (in binary mode, but encoding text)
+        with open(part_path, "wb") as out_file:
+            sections = write_cleaned_text(iter_page_texts(pdf_path), out_file)
+        os.replace(part_path, txt_path)
+
+        # 6. Write the section index next to it
+        save_section_index(txt_path, sections)
+        return doi, None
+
+    except Exception as e:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        return doi, f"Error reading PDF {pdf_path}: {e}"
+
+
+def run_extraction(tasks, jobs: int = 1, on_success=None):
+    """
+    Run extract_pdf_to_text for every (doi, pdf_path, txt_path) task,
+    in a pool of `jobs` processes when jobs > 1.
+    Results are reported as they finish, so output order is not input order;
+    on_success(doi) is called for each paper as soon as it is extracted.
+    Returns the DOIs that were extracted successfully.
+    """
+    total = len(tasks)
+    succeeded = []
+
+    def report(done, doi, error):
+        if error:
+            print(f"[{done}/{total}] {error}")
         else:
-            end_idx = len(cleaned_text)
-        cleaned_text = cleaned_text[:start_idx] + cleaned_text[end_idx:]
-
-    # Remove "References"/"Bibliography" section if present
-    match = refs_pattern.search(cleaned_text)
-    if match:
-        start_idx = match.start()
-        next_header = generic_heading.search(cleaned_text, match.end())
-        if next_header:
-            end_idx = next_header.start()
-        else:
-            end_idx = len(cleaned_text)
-        cleaned_text = cleaned_text[:start_idx] + cleaned_text[end_idx:]
-
-    return cleaned_text
-
-
-def sanitize_filename(s: str) -> str:
-    return s.replace("/", "_").replace("\\", "_").replace(":", "_")
-
-
-def main():
-    with open(INPUT_DOIS_FILE, "r", encoding="utf-8") as f:
+            succeeded.append(doi)
+            print(f"[{done}/{total}] Extracted and cleaned text for DOI '{doi}'")
+            if on_success is not None:
+                on_success(doi)
+
+    if jobs <= 1:
+        for done, task in enumerate(tasks, start=1):
+            report(done, *extract_pdf_to_text(*task))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(extract_pdf_to_text, *task) for task in tasks]
+            for done, future in enumerate(as_completed(futures), start=1):
+                report(done, *future.result())
+
+    print(f"Extracted {len(succeeded)} of {total} PDFs ({total - len(succeeded)} failed)")
+    return succeeded
+
+
+def read_dois(path=INPUT_DOIS_FILE):
+    dois = []
+    with open(path, "r", encoding="utf-8") as f:
         for line in f:
             doi = line.strip()
             if not doi:
                 continue  # Skip empty lines
+            dois.append(doi)
+    return dois
 
-            # 1. Download the PDF via the downloader script
-            subprocess.run(["python3", "zotero/downloader.py", doi])
-
-            # 2. Construct the paths
-            safe_doi = sanitize_filename(doi)
-            pdf_path = os.path.join("docs", f"{safe_doi}.pdf")
-            txt_path = os.path.join("docs", "papers", f"{safe_doi}.txt")
-
-            if not os.path.isfile(pdf_path):
-                print(f"Warning: No PDF found at {pdf_path} after download step.")
-                continue
-
-            # 3. Extract text from the PDF to a single string
-            try:
-                doc = pymupdf.open(pdf_path)
-
-                # Collect all pages in one list
-                all_pages_text = []
-                for page in doc:
-                    # get_text() returns a string
-                    page_text = page.get_text()
-                    # We can optionally add a page-break marker if needed
-                    all_pages_text.append(page_text)
 
-                doc.close()
+def parse_args():
+    parser = argparse.ArgumentParser(description="Get PDFs from Zotero and convert them to text")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="number of worker processes for text extraction (default: 1)")
+    parser.add_argument("--stage", choices=STAGE_MODES, default="none",
+                        help="none: read PDFs straight from Zotero storage (default); "
+                             "link: reflink/hardlink them into docs/; copy: copy them into docs/")
+    parser.add_argument("--force", action="store_true",
+                        help=f"ignore {MANIFEST_PATH} and rebuild every paper")
+    return parser.parse_args()
 
-                # Join all pages into a single string
-                full_text = "\n\f\n".join(all_pages_text)
 
-                # 4. Remove unwanted sections (across *all* pages)
-                cleaned_text = remove_unwanted_sections(full_text)
-
-                # 5. Write the cleaned text to file (in binary mode, but encoding text)
-                with open(txt_path, "wb") as out_file:
-                    out_file.write(cleaned_text.encode("utf-8"))
-
-                print(f"Extracted and cleaned text for DOI '{doi}' -> {txt_path}")
-
-            except Exception as e:
-                print(f"Error reading PDF {pdf_path}: {e}")
+def main():
+    args = parse_args()
+    dois = read_dois()
+
+    if not os.path.isfile(ZOTERO_DB_PATH):
+        print(f"Error: Zotero DB not found at {ZOTERO_DB_PATH}")
+        return
+
+    # 1. Resolve every DOI to its PDF attachment in one go
+    with ZoteroDB() as db:
+        resolved = resolve_pdf_paths(db, dois)
+        # Year and collections end up in the manifest, rag.py filters on them
+        metadata = get_item_metadata(db, [item_id for item_id, _ in resolved.values() if item_id])
+
+    manifest = {} if args.force else load_manifest()
+    pending = {}
+    skipped = 0
+
+    tasks = []
+    for doi in dois:
+        item_id, source_path = resolved[doi]
+        if not item_id:
+            print(f"No Zotero item found with DOI = {doi}")
+            continue
+        if not source_path:
+            print(f"No PDF attachment found for DOI = {doi}")
+            continue
+        if not os.path.isfile(source_path):
+            print(f"Expected PDF file not found on disk: {source_path}")
+            continue
+
+        safe_doi = sanitize_filename(doi)
+        txt_path = os.path.join("docs", "papers", f"{safe_doi}.txt")
+
+        # Skip papers whose source and extractor did not change since the last build
+        previous = manifest.get(doi)
+        current = source_entry(source_path, previous)
+        current.update(metadata[item_id])
+        if (is_up_to_date(previous, current, EXTRACTOR_VERSION, txt_path)
+                and os.path.isfile(section_index_path(txt_path))):
+            previous.update(current)
+            skipped += 1
+            continue
+
+        # 2. Stage the PDF, by default this just reads it from Zotero storage
+        pdf_path = stage_pdf(doi, source_path, mode=args.stage)
+
+        tasks.append((doi, pdf_path, txt_path))
+        pending[doi] = (current, txt_path)
+
+    if skipped:
+        print(f"Skipping {skipped} up-to-date papers (see {MANIFEST_PATH})")
+
+    # 3-5. Extract, clean and write the text, recording each paper as it finishes
+    def record(doi):
+        entry, txt_path = pending[doi]
+        entry["extractor_version"] = EXTRACTOR_VERSION
+        entry["txt_sha256"] = file_sha256(txt_path)
+        manifest[doi] = entry
+        recorded.append(doi)
+        if len(recorded) % MANIFEST_SAVE_EVERY == 0:
+            save_manifest(manifest)
+
+    recorded = []
+    try:
+        run_extraction(tasks, args.jobs, on_success=record)
+    finally:
+        save_manifest(manifest)
 
 
 if __name__ == "__main__":
@@ -1,20 +1,38 @@
+import argparse
+import hashlib
+import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List
+
+import numpy as np
 from langchain.schema import Document
 
 # 1) LangChain modules for loading text, splitting, embeddings, and vector store
 from langchain.docstore.document import Document as LC_Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings import OpenAIEmbeddings
+from langchain.embeddings.base import Embeddings
 from langchain.vectorstores import FAISS
 
+from backends import BACKENDS, DEFAULT_BACKEND, get_chat_model, get_embeddings_backend, get_openai_client
+from embedding_cache import CachedEmbeddings
+from corpus_index import CorpusIndex, paper_metadata_from_manifest
+from answer_store import AnswerStore, text_hash
+from telemetry import Telemetry, count_tokens
+from context_packer import CONTEXT_TOKEN_BUDGET, pack_context
+from batch_api import POLL_INTERVAL, batch_request, finish_batch, run_batch
+from llm_cache import CACHE_MODES, DEFAULT_CACHE_MODE, ResponseCache, cache_key
+from sections import read_sections
+
 # 2) LangChain modules for the LLM and QA
-from langchain.chat_models import ChatOpenAI
 from langchain.prompts import PromptTemplate
-from langchain.chains import RetrievalQA
+from langchain.chains.question_answering import load_qa_chain
 
-# 3) For optional named tracing sessions (see below)
+# 3) For optional named tracing sessions (see below), and token usage for telemetry
 from langchain.callbacks import tracing_enabled
+from langchain.callbacks.base import BaseCallbackHandler
 
 # --------------------------------------------------
 # Configuration
@@ -22,6 +40,25 @@ from langchain.callbacks import tracing_enabled
 
 FOLDER_PATH = "./docs/papers"
 
+# Per-paper FAISS indexes are cached here between runs,
+# chunk and question embeddings in embedding_cache.EMBEDDING_CACHE_DIR
+CACHE_DIR = "./docs/cache"
+FAISS_CACHE_DIR = os.path.join(CACHE_DIR, "faiss")
+
+# Anything that changes the chunks or their vectors must be part of the cache key
+CHUNK_SIZE = 3000
+CHUNK_OVERLAP = 200
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+LLM_MODEL = "o1-preview"  # update as needed
+RETRIEVER_K = 6
+# Retrieved chunks are packed into this many tokens per question (0: send all k chunks)
+CONTEXT_TOKENS = CONTEXT_TOKEN_BUDGET
+
+# Default caps: LLM calls in flight across all papers, and papers open at once
+MAX_CONCURRENCY = 4
+MAX_PAPERS = 2
+
 # The same questions you used before
 QUESTIONS = [
     {
@@ -118,49 +155,70 @@ prompt = PromptTemplate(
 # Helper Function
 # --------------------------------------------------
 
-def build_vectorstore_from_text(text: str, source_filename: str) -> FAISS:
+def get_embeddings(backend: str = DEFAULT_BACKEND, telemetry: Telemetry = None) -> CachedEmbeddings:
+    """Backend embeddings behind the chunk-level cache, only new texts are sent to the API."""
+    embeddings, model = get_embeddings_backend(backend, EMBEDDING_MODEL)
+    return CachedEmbeddings(embeddings, model, telemetry=telemetry)
+
+
+def vectorstore_cache_key(text: str, source_filename: str, embedding_model: str = EMBEDDING_MODEL) -> str:
+    """Hash of the paper text plus every setting that affects its chunks and vectors."""
+    settings = json.dumps({
+        "source": source_filename,
+        "splitter": "RecursiveCharacterTextSplitter",
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "add_start_index": True,
+        "embedding_model": embedding_model,
+    }, sort_keys=True)
+    return hashlib.sha256(f"{settings}\0{text}".encode("utf-8")).hexdigest()
+
+
+def build_vectorstore_from_text(text: str, source_filename: str, embeddings: Embeddings = None) -> FAISS:
     """
     Given a file's text, split it into smaller chunks,
     embed them, and store them in a local FAISS vector store.
     Returns the vectorstore object.
     """
-    # Attach the filename as metadata so we can reference it in citations
+    # Attach the filename as metadata so we can reference it in citations,
+    # the splitter adds each chunk's start_index for merging overlapping chunks
     raw_doc = LC_Document(page_content=text, metadata={"source": source_filename})
     
-    splitter = RecursiveCharacterTextSplitter(chunk_size=3000, chunk_overlap=200)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+                                              add_start_index=True)
     docs = splitter.split_documents([raw_doc])
 
-    embeddings = OpenAIEmbeddings()  # uses OPENAI_API_KEY from environment
+    if embeddings is None:
+        embeddings = get_embeddings()  # uses OPENAI_API_KEY from environment
     vectorstore = FAISS.from_documents(docs, embedding=embeddings)
     return vectorstore
 
 
-def answer_question(vectorstore: FAISS, question: str) -> str:
+def load_or_build_vectorstore(text: str, source_filename: str, embeddings: Embeddings = None) -> FAISS:
     """
-    Given a vector store and a question, retrieve relevant chunks
-    and run the LLM chain to get an answer + citations.
+    Load the paper's FAISS store from FAISS_CACHE_DIR when this exact text was
+    indexed with the current settings before, otherwise build and save it.
     """
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 6})
+    if embeddings is None:
+        embeddings = get_embeddings()
+    embedding_model = getattr(embeddings, "model", EMBEDDING_MODEL)
+    cache_path = os.path.join(FAISS_CACHE_DIR, vectorstore_cache_key(text, source_filename, embedding_model))
+    if os.path.isfile(os.path.join(cache_path, "index.faiss")):
+        return FAISS.load_local(cache_path, embeddings)
 
-    llm = ChatOpenAI(
-        model_name="o1-preview",  # update as needed
-        temperature=1.0
-    )
-    
-    # IMPORTANT: we set return_source_documents=True
-    qa_chain = RetrievalQA.from_chain_type(
-        llm=llm,
-        chain_type="stuff",
-        retriever=retriever,
-        chain_type_kwargs={"prompt": prompt},
-        return_source_documents=True,
-    )
+    vectorstore = build_vectorstore_from_text(text, source_filename, embeddings)
+    vectorstore.save_local(cache_path)
+    return vectorstore
+
+
+def stuff_prompt(source_docs: List[Document], question: str) -> str:
+    """The prompt the stuff chain builds: the chunks joined by blank lines as context."""
+    context = "\n\n".join(doc.page_content for doc in source_docs)
+    return prompt.format(context=context, question=question)
 
-    # Instead of .run(...), we call the chain as a dict to get the docs
-    chain_result = qa_chain({"query": question})
-    answer = chain_result["result"]
-    source_docs = chain_result["source_documents"]
 
+def format_citations(source_docs: List[Document]) -> str:
+    """A small list of citations (source file + snippet) for the answer."""
     # Build a simple list of citations. 
     # You might want to shorten doc.page_content or highlight relevant sentences only.
     citations = []
@@ -170,51 +228,415 @@ def answer_question(vectorstore: FAISS, question: str) -> str:
         source_name = doc.metadata.get("source", "unknown_file")
         citations.append(f"{i}. [Source: {source_name}] \"{snippet}...\"")
 
-    # Create a final string that includes the answer plus a small list of citations
-    citations_str = "\n".join(citations)
-    final_text = f"{answer}\n\nCitations:\n{citations_str}"
-    return final_text.strip()
+    return "\n".join(citations)
+
+
+class UsageCallback(BaseCallbackHandler):
+    """Collects the prompts, token usage and retries of one chain run."""
+
+    def __init__(self):
+        self.prompts = []
+        self.token_usage = {}
+        self.retries = 0
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.prompts.extend(prompts)
+
+    def on_llm_end(self, response, **kwargs):
+        for key, value in ((response.llm_output or {}).get("token_usage") or {}).items():
+            if isinstance(value, int):
+                self.token_usage[key] = self.token_usage.get(key, 0) + value
+
+    def on_retry(self, retry_state, **kwargs):
+        self.retries += 1
+
+
+class AnalysisSession:
+    """
+    Long-lived state for an analysis run: one LLM client and one "stuff" QA
+    chain built from the prompt, shared by every paper and question.
+    Retrieved chunks are packed into context_tokens before they are sent.
+    Records how long setup, retrieval and generation take, and every LLM
+    call in telemetry when given. With a response cache, a prompt answered
+    before is not sent again.
+    """
+
+    def __init__(self, backend: str = DEFAULT_BACKEND, model_name: str = LLM_MODEL,
+                 temperature: float = 1.0, k: int = RETRIEVER_K, telemetry: Telemetry = None,
+                 context_tokens: int = CONTEXT_TOKENS, cache: ResponseCache = None):
+        started = time.perf_counter()
+        self.k = k
+        self.temperature = temperature
+        self.cache = cache
+        self.context_tokens = context_tokens
+        self.model_name = model_name
+        self.telemetry = telemetry
+        # Answers are stored per model, keep offline ones apart from real ones
+        self.model = model_name if backend == "openai" else f"{backend}:{model_name}"
+        self.llm = get_chat_model(backend, model_name, temperature)
+        self.qa_chain = load_qa_chain(self.llm, chain_type="stuff", prompt=prompt)
+        self.timings = {"setup": [time.perf_counter() - started], "retrieval": [], "generation": []}
+        self._lock = threading.Lock()
+
+    def _record(self, stage: str, seconds: float):
+        with self._lock:
+            self.timings[stage].append(seconds)
+
+    def pack(self, scored_docs: List[tuple]) -> List[Document]:
+        """The chunks that go into the prompt, within context_tokens when it is set."""
+        if self.context_tokens > 0:
+            return pack_context(scored_docs, self.context_tokens, self.model_name)
+        return [doc for doc, _ in scored_docs]
+
+    def answer_from_documents(self, scored_docs: List[tuple], question: str,
+                              paper: str = None, question_id=None) -> tuple:
+        """
+        Pack the retrieved (chunk, distance) pairs, nearest first, and run the
+        shared chain on them. Returns (answer, citations).
+        """
+        source_docs = self.pack(scored_docs)
+        key = self.cache_key(source_docs, question)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached, format_citations(source_docs)
+
+        usage = UsageCallback()
+        started = time.perf_counter()
+        answer, error = "", None
+        try:
+            answer = self.qa_chain.run(input_documents=source_docs, question=question, callbacks=[usage])
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            self._record("generation", seconds)
+            # Backends that report no usage (offline) are counted with the model's tokenizer
+            prompt_tokens = (usage.token_usage.get("prompt_tokens")
+                             or sum(count_tokens(p, self.model_name) for p in usage.prompts))
+            completion_tokens = usage.token_usage.get("completion_tokens") or count_tokens(answer, self.model_name)
+            if self.telemetry is not None:
+                self.telemetry.record(
+                    "llm", self.model, seconds, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                    paper=paper, question_id=question_id, retries=usage.retries, error=error,
+                )
+        if self.cache is not None:
+            self.cache.put(key, self.model, answer.strip(), prompt_tokens, completion_tokens)
+        return answer.strip(), format_citations(source_docs)
+
+    def cache_key(self, source_docs: List[Document], question: str) -> str:
+        return cache_key(self.model, stuff_prompt(source_docs, question), {"temperature": self.temperature})
+
+    def timing_summary(self) -> str:
+        lines = ["Timings:"]
+        for stage, values in self.timings.items():
+            if values:
+                lines.append(
+                    f"  {stage:<10} {len(values):>5} calls, "
+                    f"total {sum(values):8.2f}s, mean {1000 * sum(values) / len(values):8.1f}ms"
+                )
+        return "\n".join(lines)
 
 # --------------------------------------------------
 # Main Script
 # --------------------------------------------------
 
+def get_corpus_index(embeddings: CachedEmbeddings) -> CorpusIndex:
+    """Load the corpus-wide index and bring it up to date with FOLDER_PATH."""
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+                                              add_start_index=True)
+    settings = {
+        "splitter": "RecursiveCharacterTextSplitter",
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "add_start_index": True,
+        "embedding_model": embeddings.model,
+    }
+    corpus = CorpusIndex(embeddings, splitter, settings)
+    counts = corpus.sync(FOLDER_PATH, paper_metadata_from_manifest())
+    print(f"Corpus index: {counts['added']} papers added, {counts['removed']} removed, "
+          f"{counts['unchanged']} unchanged")
+    return corpus
+
+
+def embed_questions(embeddings: Embeddings, questions: list) -> dict:
+    """Embed every question once per run: {question id: vector}."""
+    vectors = embeddings.embed_documents([q["question"] for q in questions])
+    return {q["id"]: np.asarray(vector, dtype=np.float32) for q, vector in zip(questions, vectors)}
+
+
+def vectorstore_chunks(vectorstore: FAISS) -> tuple:
+    """All chunks of a FAISS store and their vectors as one (n, dim) matrix."""
+    count = vectorstore.index.ntotal
+    docs = [vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]) for i in range(count)]
+    return docs, vectorstore.index.reconstruct_n(0, count)
+
+
+def retrieve_batch(question_matrix: np.ndarray, chunk_matrix: np.ndarray, docs: List[Document], k: int) -> list:
+    """
+    Top-k chunks for every question in one go: a single matmul gives all
+    squared L2 distances (the metric of the FAISS index), argpartition the top-k.
+    Returns one list of (document, distance) pairs per question row, nearest first.
+    """
+    if not docs:
+        return [[] for _ in range(len(question_matrix))]
+    distances = (
+        (question_matrix ** 2).sum(axis=1)[:, None]
+        + (chunk_matrix ** 2).sum(axis=1)[None, :]
+        - 2.0 * question_matrix @ chunk_matrix.T
+    )
+    k = min(k, len(docs))
+    top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    results = []
+    for row, candidates in enumerate(np.sort(top, axis=1)):
+        # Stable sort on position-ordered candidates: ties break like FAISS
+        ordered = candidates[np.argsort(distances[row, candidates], kind="stable")]
+        results.append([(docs[i], float(distances[row, i])) for i in ordered])
+    return results
+
+
+def answer_and_store(session: AnalysisSession, store: AnswerStore, scored_docs: List[tuple], filename: str,
+                     paper_hash: str, question: dict):
+    """Answer one question and store it right away, so a crash loses nothing already paid for."""
+    started = time.perf_counter()
+    answer, citations = session.answer_from_documents(scored_docs, question["question"],
+                                                      paper=filename, question_id=question["id"])
+    store.put(filename, paper_hash, question, session.model, answer, citations,
+              time.perf_counter() - started)
+
+
+def retrieve_pending(filename: str, embeddings: CachedEmbeddings, question_vectors: dict, session: AnalysisSession,
+                     store: AnswerStore, corpus: CorpusIndex = None, sections: List[str] = None) -> tuple:
+    """
+    The paper's questions that are not in the answer store yet, with the
+    chunks for all of them retrieved in one batch.
+    With a corpus index, the paper's chunks are retrieved from it instead of
+    from a per-paper vector store. With sections, only those sections of the
+    paper are indexed. Returns (paper_hash, pending, retrieved).
+    """
+    txt_path = os.path.join(FOLDER_PATH, filename)
+
+    file_content = read_sections(txt_path, sections)
+    paper_hash = text_hash(file_content)
+
+    pending = store.pending(paper_hash, QUESTIONS, session.model)
+    if not pending:
+        return paper_hash, [], []
+    if corpus is not None:
+        docs, chunk_matrix = corpus.paper_chunks(filename)
+    else:
+        # Build the vectorstore (or load it from the cache), passing the filename into metadata
+        vectorstore = load_or_build_vectorstore(file_content, filename, embeddings)
+        docs, chunk_matrix = vectorstore_chunks(vectorstore)
+
+    started = time.perf_counter()
+    question_matrix = np.stack([question_vectors[q["id"]] for q in pending])
+    retrieved = retrieve_batch(question_matrix, chunk_matrix, docs, session.k)
+    session._record("retrieval", time.perf_counter() - started)
+    return paper_hash, pending, retrieved
+
+
+def write_markdown(filename: str, paper_hash: str, store: AnswerStore, model: str) -> str:
+    """Render the paper's .md from the answer store in QUESTIONS order."""
+    base_name = os.path.splitext(filename)[0]
+    md_filename = base_name + ".md"
+    md_path = os.path.join(FOLDER_PATH, md_filename)
+
+    with open(md_path, "w", encoding="utf-8") as md_file:
+        md_file.write(store.render_markdown(paper_hash, QUESTIONS, model))
+
+    return md_filename
+
+
+def analyze_paper(filename: str, embeddings: CachedEmbeddings, question_vectors: dict, session: AnalysisSession,
+                  store: AnswerStore, llm_pool: ThreadPoolExecutor, corpus: CorpusIndex = None,
+                  sections: List[str] = None) -> str:
+    """
+    Answer every question about one paper that is not in the answer store yet.
+    The questions are sent to the shared llm_pool concurrently; the Markdown
+    is then rendered from the store.
+    """
+    paper_hash, pending, retrieved = retrieve_pending(filename, embeddings, question_vectors, session, store,
+                                                      corpus, sections)
+    futures = [
+        llm_pool.submit(answer_and_store, session, store, scored_docs, filename, paper_hash, q)
+        for q, scored_docs in zip(pending, retrieved)
+    ]
+    for future in futures:
+        future.result()
+    return write_markdown(filename, paper_hash, store, session.model)
+
+
+def ask_with_batch_api(filenames: List[str], embeddings: CachedEmbeddings, question_vectors: dict,
+                       session: AnalysisSession, store: AnswerStore, corpus: CorpusIndex, client,
+                       poll_interval: float = POLL_INTERVAL, sections: List[str] = None):
+    """
+    Retrieve and pack the context for every pending (paper, question) here,
+    send the prompts as one Batch API batch and store the answers with the
+    citations of the chunks that went into each prompt. Prompts in the
+    response cache are answered from it and left out of the batch.
+    """
+    requests, metadata = [], {}
+    for filename in filenames:
+        paper_hash, pending, retrieved = retrieve_pending(filename, embeddings, question_vectors,
+                                                          session, store, corpus, sections)
+        for q, scored_docs in zip(pending, retrieved):
+            source_docs = session.pack(scored_docs)
+            citations = format_citations(source_docs)
+            key = session.cache_key(source_docs, q["question"])
+            cached = session.cache.get(key) if session.cache is not None else None
+            if cached is not None:
+                store.put(filename, paper_hash, q, session.model, cached, citations)
+                continue
+            messages = [{"role": "user", "content": stuff_prompt(source_docs, q["question"])}]
+            custom_id = f"{filename}#{q['id']}"
+            requests.append(batch_request(custom_id, session.model_name, messages))
+            metadata[custom_id] = {"paper": filename, "paper_hash": paper_hash, "question": q,
+                                   "citations": citations, "cache_key": key}
+
+    results, metadata = run_batch(client, "rag", requests, metadata, poll_interval)
+    failed = 0
+    for custom_id, request in metadata.items():
+        result = results.get(custom_id) or {"content": None, "usage": {}, "error": "no result"}
+        if session.telemetry is not None:
+            session.telemetry.record(
+                "batch", session.model, 0.0,
+                prompt_tokens=result["usage"].get("prompt_tokens", 0),
+                completion_tokens=result["usage"].get("completion_tokens", 0),
+                paper=request["paper"], question_id=request["question"]["id"], error=result["error"],
+            )
+        if result["content"] is None:
+            failed += 1
+            continue
+        store.put(request["paper"], request["paper_hash"], request["question"], session.model,
+                  result["content"].strip(), request["citations"])
+        if session.cache is not None:
+            session.cache.put(request["cache_key"], session.model, result["content"].strip(),
+                              result["usage"].get("prompt_tokens", 0), result["usage"].get("completion_tokens", 0))
+    if metadata:
+        finish_batch("rag")
+    if failed:
+        print(f"{failed} batch requests failed, run again to ask them")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ask QUESTIONS about every paper in " + FOLDER_PATH)
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENCY,
+                        help=f"max LLM calls in flight across all papers (default: {MAX_CONCURRENCY})")
+    parser.add_argument("--papers", type=int, default=MAX_PAPERS,
+                        help=f"papers analysed at the same time (default: {MAX_PAPERS})")
+    parser.add_argument("--backend", choices=BACKENDS, default=DEFAULT_BACKEND,
+                        help="openai, or offline to run without network or API key "
+                             f"(default: {DEFAULT_BACKEND}, from LITREVIEW_BACKEND)")
+    parser.add_argument("--index", choices=("paper", "corpus"), default="paper",
+                        help="retrieve from a cached index per paper (default) "
+                             "or from the corpus-wide index filtered to the paper")
+    parser.add_argument("--context-tokens", type=int, default=CONTEXT_TOKENS,
+                        help="pack the retrieved chunks into this many tokens per question, "
+                             f"0 sends all of them (default: {CONTEXT_TOKENS})")
+    parser.add_argument("--llm-cache", choices=CACHE_MODES, default=DEFAULT_CACHE_MODE,
+                        help="use cached LLM responses, refresh them, or bypass the cache "
+                             f"(default: {DEFAULT_CACHE_MODE}, from LITREVIEW_LLM_CACHE)")
+    parser.add_argument("--batch", action="store_true",
+                        help="send all pending questions as one Batch API batch, wait for it and ingest the answers")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL,
+                        help=f"seconds between batch status checks (default: {POLL_INTERVAL})")
+    parser.add_argument("--ask", metavar="QUESTION",
+                        help="answer one question across the whole corpus instead of analysing each paper")
+    parser.add_argument("--doi", action="append", help="with --ask: only papers with this DOI (repeatable)")
+    parser.add_argument("--year", action="append", help="with --ask: only papers from this year (repeatable)")
+    parser.add_argument("--collection", action="append",
+                        help="with --ask: only papers in this Zotero collection (repeatable)")
+    parser.add_argument("--section", dest="sections", action="append", metavar="WORD",
+                        help="only index the sections whose title contains WORD (repeatable, e.g. --section method "
+                             "--section result), read via the .sections.json index mass_reader.py writes")
+    args = parser.parse_args()
+    if args.sections and (args.ask or args.index == "corpus"):
+        parser.error("--section only works with the per-paper index")
+    return args
+
+
+def ask_corpus(question: str, corpus: CorpusIndex, session: AnalysisSession, filters: dict) -> str:
+    """Answer a question from the most relevant chunks of all papers matching filters."""
+    started = time.perf_counter()
+    scored_docs = corpus.search_with_scores(question, session.k, **filters)
+    session._record("retrieval", time.perf_counter() - started)
+    answer, citations = session.answer_from_documents(scored_docs, question)
+    return f"{answer}\n\nCitations:\n{citations}"
+
+
 def main():
     # Optionally, name your session with a context manager:
     # with tracing_enabled("my_rag_session"):
+    args = parse_args()
 
-    for filename in os.listdir(FOLDER_PATH):
-        if filename.endswith(".txt"):
-            txt_path = os.path.join(FOLDER_PATH, filename)
-            
-            with open(txt_path, "r", encoding="utf-8") as f:
-                file_content = f.read()
-
-            # Build the vectorstore, passing the filename into metadata
-            vectorstore = build_vectorstore_from_text(file_content, filename)
-
-            base_name = os.path.splitext(filename)[0]
-            md_filename = base_name + ".md"
-            md_path = os.path.join(FOLDER_PATH, md_filename)
-
-            for q in QUESTIONS:
-                answer_with_citations = answer_question(vectorstore, q["question"])
-                
-                md_content = (
-                    f"## Question {q['id']}\n"
-                    f"**{q['question']}**\n"
-                    f"{answer_with_citations}\n\n"
-                )
-                with open(md_path, "a", encoding="utf-8") as md_file:
-                    md_file.write(md_content)
+    # Make sure OPENAI_API_KEY is set
+    if args.backend == "openai" and not os.environ.get("OPENAI_API_KEY"):
+        raise ValueError("Please set the OPENAI_API_KEY environment variable.")
+
+    telemetry = Telemetry("rag.py")
+    embeddings = get_embeddings(args.backend, telemetry)
+    cache = ResponseCache(args.llm_cache)
+    session = AnalysisSession(args.backend, telemetry=telemetry, context_tokens=args.context_tokens, cache=cache)
+
+    corpus = None
+    if args.ask or args.index == "corpus":
+        corpus = get_corpus_index(embeddings)
+
+    if args.ask:
+        filters = {
+            key: values
+            for key, values in (("doi", args.doi), ("year", args.year), ("collections", args.collection))
+            if values
+        }
+        print(ask_corpus(args.ask, corpus, session, filters))
+        print(embeddings.stats())
+        print(cache.stats())
+        cache.close()
+        print(telemetry.summary())
+        return
 
+    store = AnswerStore()
+    question_vectors = embed_questions(embeddings, QUESTIONS)
+    filenames = sorted(f for f in os.listdir(FOLDER_PATH) if f.endswith(".txt"))
+
+    if args.batch:
+        ask_with_batch_api(filenames, embeddings, question_vectors, session, store, corpus,
+                           get_openai_client(args.backend), args.poll_interval, args.sections)
+        for filename in filenames:
+            paper_hash = text_hash(read_sections(os.path.join(FOLDER_PATH, filename), args.sections))
+            md_filename = write_markdown(filename, paper_hash, store, session.model)
             print(f"Processed '{filename}' -> '{md_filename}'")
+        store.close()
+        print(embeddings.stats())
+        print(cache.stats())
+        cache.close()
+        print(telemetry.summary())
+        return
 
+    # Two pools, so a paper waiting on its answers never holds an LLM slot
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as llm_pool, \
+            ThreadPoolExecutor(max_workers=max(1, args.papers)) as paper_pool:
+        futures = {
+            paper_pool.submit(analyze_paper, filename, embeddings, question_vectors, session, store, llm_pool, corpus,
+                                args.sections): filename
+            for filename in filenames
+        }
+        for future in as_completed(futures):
+            filename = futures[future]
+            try:
+                md_filename = future.result()
+                print(f"Processed '{filename}' -> '{md_filename}'")
+            except Exception as e:
+                print(f"Error processing '{filename}': {e}")
 
-if __name__ == "__main__":
-    # Make sure OPENAI_API_KEY is set
-    if not os.environ.get("OPENAI_API_KEY"):
-        raise ValueError("Please set the OPENAI_API_KEY environment variable.")
+    store.close()
+    print(embeddings.stats())
+    print(cache.stats())
+    cache.close()
+    print(session.timing_summary())
+    print(telemetry.summary())
 
-    # Run
+if __name__ == "__main__":
     main()
@@ -0,0 +1,201 @@
+"""
+Split extracted paper text into sections and drop the unwanted ones.
+
+Headings are found with a single regex pass over the text, which yields a
+list of section spans; the cleaned text is then built with one join.
+
+Next to every extracted paper.txt, mass_reader writes a paper.sections.json
+index with the title, level, page and byte range of each kept section, so
+chat.py and rag.py (--section) read just the sections they need with
+read_sections().
+"""
+
+import json
+import os
+import re
+from functools import lru_cache
+
+# Heading text (after an optional "3." / "3)" number) for sections we know how to drop
+SECTION_HEADINGS = {
+    "related_work": r"related\s+works?",
+    "literature_review": r"literature\s+review",
+    "references": r"references|bibliography",
+}
+
+DEFAULT_DROP_SECTIONS = ("related_work", "literature_review", "references")
+
+SECTION_INDEX_VERSION = 1
+
+# Any short capitalized line, e.g. "Methods" or "4. Results and Discussion".
+# Restricted to a single line, so one match never hides the next heading.
+GENERIC_HEADING = r"(?!Figure|Table)(?:\d+\s*[\.\)]\s*)?[A-Z][A-Za-z0-9\-:,&\t\r\f\v ]{0,50}$"
+
+
+@lru_cache(maxsize=None)
+def heading_patterns(drop_sections: tuple = DEFAULT_DROP_SECTIONS) -> tuple:
+    """
+    Patterns matching a heading line. Headings of sections to drop are tried
+    first and captured in the 'drop' group.
+
+    Returns (first_line, after_newline): the second one starts with a literal
+    newline, which lets the regex engine skip straight to line starts instead
+    of trying a MULTILINE '^' at every character.
+    """
+    drop = "|".join(SECTION_HEADINGS[name] for name in drop_sections)
+    heading = rf"(?:(?P<drop>(?i:(?:\d+\s*[\.\)]\s*)?(?:{drop})\b.*)$)|(?P<heading>{GENERIC_HEADING}))"
+    return re.compile(heading, re.MULTILINE), re.compile(r"\n" + heading, re.MULTILINE)
+
+
+def iter_headings(text: str, drop_sections: tuple = DEFAULT_DROP_SECTIONS):
+    """Yield (start, title, drop) for every heading line, in one pass over the text."""
+    first_line, after_newline = heading_patterns(tuple(drop_sections))
+    pos = 0
+    match = first_line.match(text)
+    if match:
+        yield 0, match.group(0).strip(), match.group("drop") is not None
+        pos = match.end()
+    for match in after_newline.finditer(text, pos):
+        yield match.start() + 1, match.group(0).strip(), match.group("drop") is not None
+
+
+def find_section_spans(text: str, drop_sections: tuple = DEFAULT_DROP_SECTIONS) -> list:
+    """
+    Return [(start, end, title, drop)] spans covering the whole text.
+    Each section runs from its heading to the next heading; text before the
+    first heading is a span with title None.
+    """
+    spans = []
+    start, title, drop = 0, None, False
+    for heading_start, heading_title, heading_drop in iter_headings(text, drop_sections):
+        # Skip the empty preamble, keep empty sections (heading right after heading)
+        if heading_start > start or title is not None:
+            spans.append((start, heading_start, title, drop))
+        start, title, drop = heading_start, heading_title, heading_drop
+    spans.append((start, len(text), title, drop))
+    return spans
+
+
+def remove_unwanted_sections(text: str, drop_sections: tuple = DEFAULT_DROP_SECTIONS) -> str:
+    """Remove 'Related Work' / 'Literature Review' / 'References' sections (every occurrence) from text."""
+    return "".join(
+        text[start:end]
+        for start, end, _, drop in find_section_spans(text, drop_sections)
+        if not drop
+    )
+
+
+def iter_stream_spans(chunks, drop_sections: tuple = DEFAULT_DROP_SECTIONS):
+    """
+    Streaming counterpart of find_section_spans: takes an iterable of text
+    chunks (e.g. pages) and yields (piece, title, drop, page) for consecutive
+    pieces of the text. title is set when the piece starts with a heading and
+    None when it continues the previous section; page is the 1-based page the
+    piece starts on, counting form feeds.
+
+    Only complete lines are scanned; the unfinished last line of a chunk is
+    carried over to the next one, so memory is bounded by one chunk plus one
+    line. A numbered heading split over a chunk boundary ("3.\\nReferences")
+    is not recognised as such.
+    """
+    dropping = False
+    page = 1
+    carry = ""
+
+    def windows():
+        nonlocal carry
+        for chunk in chunks:
+            buf = carry + chunk
+            cut = buf.rfind("\n") + 1
+            window, carry = buf[:cut], buf[cut:]
+            if window:
+                yield window
+        if carry:
+            yield carry
+
+    for window in windows():
+        for start, end, title, drop in find_section_spans(window, drop_sections):
+            # The text before the first heading continues the previous section
+            if title is not None:
+                dropping = drop
+            if end > start or title is not None:
+                yield window[start:end], title, dropping, page
+            page += window.count("\f", start, end)
+
+
+def heading_level(title: str) -> int:
+    """'3.2.1 Setup' -> 3, 'Methods' -> 1, text before the first heading -> 0."""
+    if title is None:
+        return 0
+    match = re.match(r"\d+(?:\.\d+)*", title)
+    return match.group(0).count(".") + 1 if match else 1
+
+
+def write_cleaned_text(chunks, out_file, drop_sections: tuple = DEFAULT_DROP_SECTIONS) -> list:
+    """
+    Stream the cleaned text of chunks into out_file (opened in binary mode)
+    and return the section index: one dict per kept section with its title,
+    level, page and [start, end) byte offsets in the written file.
+    """
+    sections = []
+    offset = 0
+    for piece, title, drop, page in iter_stream_spans(chunks, drop_sections):
+        if drop:
+            continue
+        if title is not None or not sections:
+            sections.append({
+                "title": title,
+                "level": heading_level(title),
+                "page": page,
+                "start": offset,
+                "end": offset,
+            })
+        data = piece.encode("utf-8")
+        out_file.write(data)
+        offset += len(data)
+        sections[-1]["end"] = offset
+    return sections
+
+
+def section_index_path(txt_path: str) -> str:
+    return os.path.splitext(txt_path)[0] + ".sections.json"
+
+
+def save_section_index(txt_path: str, sections: list):
+    path = section_index_path(txt_path)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"version": SECTION_INDEX_VERSION, "sections": sections}, f)
+    os.replace(path + ".tmp", path)
+
+
+def load_section_index(txt_path: str) -> list:
+    """Return the section index of a paper, or None when it has no sidecar."""
+    path = section_index_path(txt_path)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["sections"]
+
+
+def read_sections(txt_path: str, wanted=None) -> str:
+    """
+    Read only the sections whose title contains one of the wanted words
+    (case-insensitive), seeking to their byte offsets. Falls back to the
+    whole file when there is no index or nothing matches.
+    """
+    sections = load_section_index(txt_path)
+    wanted = [w.lower() for w in wanted or []]
+    if sections and wanted:
+        sections = [
+            s for s in sections
+            if s["title"] and any(w in s["title"].lower() for w in wanted)
+        ]
+    if not sections or not wanted:
+        with open(txt_path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    parts = []
+    with open(txt_path, "rb") as f:
+        for section in sections:
+            f.seek(section["start"])
+            parts.append(f.read(section["end"] - section["start"]).decode("utf-8"))
+    return "".join(parts)
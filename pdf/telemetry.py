@@ -0,0 +1,242 @@
+"""
+Per-call telemetry for the LLM and embedding calls of rag.py, chat.py and
+zotero/harvester.py.
+
+Every call is appended as one JSON line to TELEMETRY_PATH: run id, kind
+(llm / batch / embedding), paper, question id, model, prompt and completion tokens,
+wall time, retries, estimated cost and error. At the end of a run the
+scripts print a summary with p50/p95 latency and token and cost totals per
+paper and per question, so it is easy to see what dominates spend and time.
+
+Summarise the whole file (or one run) later with:
+    python3 pdf/telemetry.py [--run RUN_ID] [path]
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from typing import List, Optional
+
+try:
+    import tiktoken
+except ImportError:  # token counts fall back to a characters / 4 estimate
+    tiktoken = None
+
+TELEMETRY_PATH = "./docs/telemetry.jsonl"
+
+# Estimated USD per 1M (prompt, completion) tokens; update when prices change.
+# Models not listed here are recorded with cost None.
+PRICES_PER_MILLION = {
+    "o1-preview": (15.00, 60.00),
+    "o1-mini": (3.00, 12.00),
+    "o1": (15.00, 60.00),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "text-embedding-ada-002": (0.10, 0.0),
+    "text-embedding-3-small": (0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.0),
+    "claude-3-sonnet": (3.00, 15.00),
+    "claude-3-haiku": (0.25, 1.25),
+}
+# Batch API requests (kind "batch") are billed at this fraction of the price
+BATCH_PRICE_FACTOR = 0.5
+
+# chat.py and harvester.py turn the SDKs' own retries off (they are not
+# reported) and retry here instead, so every record carries its retry count
+MAX_RETRIES = 2
+RETRY_BASE_DELAY = 0.5
+RETRYABLE_STATUS_CODES = (408, 409, 429)
+
+
+def model_price(model: str) -> Optional[tuple]:
+    """
+    Prices for the longest matching model prefix, so dated snapshots (o1-mini-2024-09-12) match too.
+    Models recorded as "<backend>:<model>" (e.g. offline) cost nothing real.
+    """
+    if ":" in model:
+        return None
+    matches = [name for name in PRICES_PER_MILLION if model.startswith(name)]
+    return PRICES_PER_MILLION[max(matches, key=len)] if matches else None
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    price = model_price(model)
+    if price is None:
+        return None
+    return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+
+
+def is_retryable(error: Exception) -> bool:
+    """Timeouts, connection errors, rate limits and server errors, as the OpenAI and Anthropic SDKs retry them."""
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS_CODES or status >= 500
+    return any(cls.__name__ in ("APIConnectionError", "APITimeoutError") for cls in type(error).__mro__)
+
+
+def retry_delay(retry: int) -> float:
+    """Exponential backoff before the given (1-based) retry."""
+    return RETRY_BASE_DELAY * 2 ** (retry - 1)
+
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def get_encoding(model: str):
+    """The model's tiktoken encoding (o200k_base for unknown models), None when unavailable."""
+    model = model.split(":")[-1]
+    if model in _encodings:
+        return _encodings[model]
+    with _encodings_lock:
+        if model in _encodings:
+            return _encodings[model]
+        encoding = None
+        if tiktoken is not None:
+            try:
+                try:
+                    encoding = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    encoding = tiktoken.get_encoding("o200k_base")
+            except Exception as e:  # tiktoken downloads encodings on first use
+                print(f"Warning: no tokenizer for {model} ({type(e).__name__}), estimating tokens as characters / 4")
+        _encodings[model] = encoding
+        return encoding
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    encoding = get_encoding(model)
+    if encoding is None:
+        return len(text) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile, p in 0..100."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+class Telemetry:
+    """Thread-safe JSONL sink; keeps this run's records in memory for summary()."""
+
+    def __init__(self, script: str, path: str = TELEMETRY_PATH):
+        self.script = script
+        self.path = path
+        self.run_id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        self.records = []
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def record(self, kind: str, model: str, seconds: float, prompt_tokens: int = 0,
+               completion_tokens: int = 0, paper: str = None, question_id=None,
+               retries: int = 0, error: str = None) -> dict:
+        cost = estimate_cost(model, prompt_tokens, completion_tokens)
+        if cost is not None and kind == "batch":
+            cost *= BATCH_PRICE_FACTOR
+        record = {
+            "run_id": self.run_id,
+            "script": self.script,
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "kind": kind,
+            "paper": paper,
+            "question_id": question_id,
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "seconds": round(seconds, 4),
+            "retries": retries,
+            "cost_usd": cost,
+            "error": error,
+        }
+        line = json.dumps(record)
+        with self._lock:
+            self.records.append(record)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        return record
+
+    def summary(self) -> str:
+        with self._lock:
+            records = list(self.records)
+        return summarize(records, f"Telemetry for run {self.run_id} (details in {self.path}):")
+
+
+def _group_line(label: str, records: List[dict]) -> str:
+    seconds = [r["seconds"] for r in records]
+    prompt_tokens = sum(r["prompt_tokens"] for r in records)
+    completion_tokens = sum(r["completion_tokens"] for r in records)
+    costs = [r["cost_usd"] for r in records if r["cost_usd"] is not None]
+    cost = f"${sum(costs):8.4f}" if costs else "        -"
+    retries = sum(r["retries"] for r in records)
+    errors = sum(1 for r in records if r["error"])
+    return (
+        f"  {label:<40.40} {len(records):>5} calls  p50 {percentile(seconds, 50):7.2f}s  "
+        f"p95 {percentile(seconds, 95):7.2f}s  tokens {prompt_tokens:>9} in {completion_tokens:>7} out  "
+        f"{cost}  retries {retries}  errors {errors}"
+    )
+
+
+def _grouped(records: List[dict], key: str) -> List[tuple]:
+    """(value, records) groups, the most expensive (then most tokens) first."""
+    groups = {}
+    for record in records:
+        groups.setdefault(record[key], []).append(record)
+    return sorted(
+        groups.items(),
+        key=lambda item: (
+            -sum(r["cost_usd"] or 0.0 for r in item[1]),
+            -sum(r["prompt_tokens"] + r["completion_tokens"] for r in item[1]),
+        ),
+    )
+
+
+def summarize(records: List[dict], title: str = "Telemetry:", top: int = 10) -> str:
+    if not records:
+        return f"{title}\n  no calls recorded"
+    lines = [title]
+    for kind, group in sorted(_grouped(records, "kind"), key=lambda item: str(item[0])):
+        lines.append(_group_line(f"{kind} (all)", group))
+    llm_records = [r for r in records if r["kind"] != "embedding"]
+    for key, heading in (("paper", "By paper:"), ("question_id", "By question:")):
+        groups = [(value, group) for value, group in _grouped(llm_records, key) if value is not None]
+        if groups:
+            lines.append(heading)
+            for value, group in groups[:top]:
+                lines.append(_group_line(str(value), group))
+            if len(groups) > top:
+                lines.append(f"  ... {len(groups) - top} more")
+    return "\n".join(lines)
+
+
+def load_records(path: str = TELEMETRY_PATH, run_id: str = None) -> List[dict]:
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                if run_id is None or record["run_id"] == run_id:
+                    records.append(record)
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise recorded LLM and embedding calls")
+    parser.add_argument("path", nargs="?", default=TELEMETRY_PATH)
+    parser.add_argument("--run", help="only this run id (default: every run in the file)")
+    parser.add_argument("--top", type=int, default=10, help="papers and questions listed (default: 10)")
+    args = parser.parse_args()
+    records = load_records(args.path, args.run)
+    print(summarize(records, f"Telemetry from {args.path}:", args.top))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark: title_index.group_similar_titles vs. the quadratic grouping
+dedup-by-title.py used before, on synthetic libraries.
+
+Titles are drawn from a Zipf-distributed vocabulary plus stopwords; about
+15% are noisy copies of earlier titles (case, typos, a dropped or added
+word, a subtitle). The old grouping takes minutes at 2000 titles, so it only
+runs on the --legacy sample, where both groupings are compared.
+
+Usage: python3 zotero/bench_title_dedup.py [--legacy N] [titles ...]
+"""
+
+import argparse
+import itertools
+import random
+import time
+
+from title_index import group_similar_titles, normalize_title, similar
+
+SYLLABLES = "ka lo mi tra ne sto vi gra pel dun ri so ta ex com pre neu ral lea rn ing mod el dat ba yes ian".split()
+STOPWORDS = ["of", "the", "a", "for", "in", "and", "on", "with", "learning", "using", "towards"]
+
+
+def synthetic_titles(count: int, seed: int = 0) -> list:
+    """[(itemID, title)]"""
+    rng = random.Random(seed)
+    vocabulary = ["".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(30000)]
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) ** 0.9 for rank in range(len(vocabulary))))
+    titles = []
+    for item_id in range(1, count + 1):
+        if titles and rng.random() < 0.15:
+            _, title = rng.choice(titles)
+            variant = rng.randrange(4)
+            if variant == 0:
+                title = title.upper() + "."
+            elif variant == 1:
+                for _ in range(rng.randint(1, 3)):
+                    i = rng.randrange(len(title))
+                    title = title[:i] + rng.choice("abcdefgh") + title[i + 1:]
+            elif variant == 2:
+                title = title.replace(" the ", " ", 1) if " the " in title else title + " a"
+            else:
+                title = f"{title}: {rng.choice(vocabulary)}"
+        else:
+            words = [rng.choice(STOPWORDS) if rng.random() < 0.3 else rng.choices(vocabulary, cum_weights=cum_weights)[0]
+                     for _ in range(rng.randint(5, 14))]
+            title = " ".join(words).capitalize()
+        titles.append((item_id, title))
+    return titles
+
+
+def group_similar_titles_legacy(items) -> dict:
+    """The previous implementation: every title against every group key."""
+    groups = {}
+    for item_id, title in items:
+        if title:
+            normalized_title = normalize_title(title)
+            for key in groups:
+                if similar(key, normalized_title):
+                    groups[key].append((item_id, title))
+                    break
+            else:
+                groups[normalized_title] = [(item_id, title)]
+    return groups
+
+
+def _leaders(groups) -> dict:
+    """itemID -> lowest itemID of its group, the item dedup-by-title.py keeps."""
+    return {item_id: min(member for member, _ in members)
+            for members in groups.values() for item_id, _ in members}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("sizes", nargs="*", type=int, default=[10000, 50000, 200000])
+    parser.add_argument("--legacy", type=int, default=1000, metavar="N",
+                        help="compare with the old grouping on N titles (0 to skip)")
+    args = parser.parse_args()
+
+    print(f"{'titles':>8} {'legacy s':>9} {'indexed s':>10} {'groups':>8} {'duplicates':>11}  items in another group")
+    runs = ([(args.legacy, True)] if args.legacy else []) + [(size, False) for size in args.sizes]
+    for size, compare in runs:
+        items = synthetic_titles(size)
+        started = time.perf_counter()
+        groups = group_similar_titles(items)
+        indexed = time.perf_counter() - started
+        duplicates = sum(len(members) - 1 for members in groups.values())
+        legacy_column, differing = "-", "-"
+        if compare:
+            started = time.perf_counter()
+            legacy = group_similar_titles_legacy(items)
+            legacy_column = f"{time.perf_counter() - started:.1f}"
+            old, new = _leaders(legacy), _leaders(groups)
+            differing = str(sum(old[item_id] != new[item_id] for item_id in old))
+        print(f"{size:>8} {legacy_column:>9} {indexed:>10.1f} {len(groups):>8} {duplicates:>11}  {differing}")
+
+
+if __name__ == "__main__":
+    main()
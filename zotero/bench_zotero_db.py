@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark: queries through zotero_db.ZoteroDB (field IDs loaded once, padded
+batches) vs. the old per-script queries that join `fields` and compare
+fieldName in every statement.
+
+Builds a synthetic library with Zotero's table layout and indexes in a
+temporary directory, so no real zotero.sqlite is touched.
+
+Usage: python3 zotero/bench_zotero_db.py [items ...]
+"""
+
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from zotero_db import ZoteroDB, connect_readonly
+
+SCHEMA = """
+CREATE TABLE itemTypes (itemTypeID INTEGER PRIMARY KEY, typeName TEXT, templateItemTypeID INT, display INT DEFAULT 1);
+CREATE TABLE fields (fieldID INTEGER PRIMARY KEY, fieldName TEXT, fieldFormatID INT);
+CREATE TABLE creatorTypes (creatorTypeID INTEGER PRIMARY KEY, creatorType TEXT);
+CREATE TABLE items (itemID INTEGER PRIMARY KEY, itemTypeID INT NOT NULL, dateAdded TEXT, libraryID INT NOT NULL DEFAULT 1, key TEXT NOT NULL);
+CREATE TABLE itemDataValues (valueID INTEGER PRIMARY KEY, value UNIQUE);
+CREATE TABLE itemData (itemID INT, fieldID INT, valueID, PRIMARY KEY (itemID, fieldID));
+CREATE INDEX itemData_fieldID ON itemData(fieldID);
+CREATE TABLE creators (creatorID INTEGER PRIMARY KEY, firstName TEXT, lastName TEXT, fieldMode INT);
+CREATE TABLE itemCreators (itemID INT NOT NULL, creatorID INT NOT NULL, creatorTypeID INT NOT NULL DEFAULT 1,
+                           orderIndex INT NOT NULL DEFAULT 0,
+                           PRIMARY KEY (itemID, creatorID, creatorTypeID, orderIndex));
+CREATE INDEX itemCreators_creatorTypeID ON itemCreators(creatorTypeID);
+CREATE TABLE itemAttachments (itemID INTEGER PRIMARY KEY, parentItemID INT, linkMode INT, contentType TEXT, path TEXT);
+CREATE INDEX itemAttachments_parentItemID ON itemAttachments(parentItemID);
+CREATE TABLE collections (collectionID INTEGER PRIMARY KEY, collectionName TEXT NOT NULL);
+CREATE TABLE collectionItems (collectionID INT NOT NULL, itemID INT NOT NULL, orderIndex INT NOT NULL DEFAULT 0,
+                              PRIMARY KEY (collectionID, itemID));
+CREATE INDEX collectionItems_itemID ON collectionItems(itemID);
+"""
+
+# Zotero 7 numbering: attachment is 3 (it was 14 before)
+ITEM_TYPES = [(1, "annotation"), (2, "artwork"), (3, "attachment"), (11, "conferencePaper"),
+              (22, "journalArticle"), (28, "note")]
+FIELDS = ["title", "abstractNote", "artworkMedium", "medium", "artworkSize", "date", "language",
+          "shortTitle", "archive", "archiveLocation", "libraryCatalog", "callNumber", "rights",
+          "extra", "accessDate", "url", "publicationTitle", "volume", "issue", "pages", "series",
+          "seriesTitle", "journalAbbreviation", "DOI", "ISSN", "proceedingsTitle", "conferenceName",
+          "place", "publisher", "ISBN"]
+WORDS = "model student knowledge tracing data learning sequence prediction skill deep bayesian".split()
+
+
+def synthetic_library(path: str, items: int, seed: int = 0, duplicates: float = 0.05):
+    """A library of papers with authors, venue, DOI and a PDF attachment each; some DOIs repeat."""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.executemany("INSERT INTO itemTypes (itemTypeID, typeName) VALUES (?, ?)", ITEM_TYPES)
+    conn.executemany("INSERT INTO fields (fieldID, fieldName) VALUES (?, ?)", list(enumerate(FIELDS, start=1)))
+    conn.executemany("INSERT INTO creatorTypes VALUES (?, ?)", [(1, "author"), (2, "contributor"), (3, "editor")])
+    conn.executemany("INSERT INTO collections VALUES (?, ?)", [(n, f"Collection {n}") for n in range(1, 21)])
+    field_id = {name: n for n, name in enumerate(FIELDS, start=1)}
+    values = {}
+
+    def value_id(value):
+        if value not in values:
+            values[value] = len(values) + 1
+        return values[value]
+
+    item_rows, data_rows, creator_rows, item_creator_rows, attachment_rows, collection_rows = [], [], [], [], [], []
+    item_id = 0
+    for n in range(items):
+        item_id += 1
+        type_id = 22 if n % 3 else 11
+        item_rows.append((item_id, type_id, "2024-01-01", f"P{n:07d}"))
+        doi = f"10.1000/{rng.randrange(items) if rng.random() < duplicates else n}"
+        title = " ".join(rng.choice(WORDS) for _ in range(8)).capitalize() + f" {n}"
+        fields = {"title": title, "DOI": doi, "date": f"{1990 + n % 35}-0{1 + n % 9}-01",
+                  "url": f"https://doi.org/{doi}", "language": "en", "pages": f"{n % 300}-{n % 300 + 12}",
+                  "abstractNote": f"We study {title.lower()}.", "accessDate": "2024-01-01 10:00:00"}
+        if type_id == 22:
+            fields["publicationTitle"] = f"Journal {n % 50}"
+        else:
+            fields["proceedingsTitle"] = f"Proceedings {n % 30}"
+            fields["conferenceName"] = f"Conference {n % 30}"
+        data_rows.extend((item_id, field_id[name], value_id(value)) for name, value in fields.items())
+        for order in range(1 + n % 4):
+            creator_rows.append((len(creator_rows) + 1, f"First{n}_{order}", f"Last{n}_{order}", 0))
+            item_creator_rows.append((item_id, len(creator_rows), 1, order))
+        collection_rows.append((1 + n % 20, item_id))
+        parent = item_id
+        item_id += 1
+        item_rows.append((item_id, 3, "2024-01-01", f"A{n:07d}"))
+        attachment_rows.append((item_id, parent, 0, "application/pdf", f"storage:paper{n}.pdf"))
+        data_rows.append((item_id, field_id["title"], value_id("Full Text PDF")))
+
+    conn.executemany("INSERT INTO items (itemID, itemTypeID, dateAdded, key) VALUES (?, ?, ?, ?)", item_rows)
+    conn.executemany("INSERT INTO itemDataValues VALUES (?, ?)", [(v, k) for k, v in values.items()])
+    conn.executemany("INSERT INTO itemData VALUES (?, ?, ?)", data_rows)
+    conn.executemany("INSERT INTO creators VALUES (?, ?, ?, ?)", creator_rows)
+    conn.executemany("INSERT INTO itemCreators VALUES (?, ?, ?, ?)", item_creator_rows)
+    conn.executemany("INSERT INTO itemAttachments VALUES (?, ?, ?, ?, ?)", attachment_rows)
+    conn.executemany("INSERT INTO collectionItems (collectionID, itemID) VALUES (?, ?)", collection_rows)
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+# -- the queries as the scripts ran them before zotero_db.py ------------------
+
+def legacy_dois(conn, dois):
+    query = """
+    SELECT itemDataValues.value, items.itemID
+      FROM items
+      JOIN itemData       ON items.itemID = itemData.itemID
+      JOIN itemDataValues ON itemData.valueID = itemDataValues.valueID
+      JOIN fields         ON itemData.fieldID = fields.fieldID
+     WHERE fields.fieldName = 'DOI'
+       AND itemDataValues.value IN ({})
+     ORDER BY items.itemID
+    """
+    dois = list(set(dois))
+    rows = []
+    for i in range(0, len(dois), 500):
+        batch = dois[i:i + 500]
+        rows.extend(conn.execute(query.format(",".join("?" * len(batch))), batch))
+    return rows
+
+
+def legacy_paper_info(conn, item_id):
+    """get_paper_info.py: one query per field, each resolving fieldName."""
+    field_query = """
+    SELECT itemDataValues.value
+    FROM itemData
+    JOIN itemDataValues ON itemData.valueID = itemDataValues.valueID
+    JOIN fields ON itemData.fieldID = fields.fieldID
+    WHERE itemData.itemID = ?
+      AND fields.fieldName = ?
+    """
+    authors = conn.execute("""
+    SELECT creators.lastName, creators.firstName
+    FROM itemCreators
+    JOIN creators ON itemCreators.creatorID = creators.creatorID
+    JOIN creatorTypes ON itemCreators.creatorTypeID = creatorTypes.creatorTypeID
+    WHERE itemCreators.itemID = ?
+      AND creatorTypes.creatorType = 'author'
+    ORDER BY itemCreators.orderIndex
+    """, (item_id,)).fetchall()
+    type_name = conn.execute("""
+    SELECT itemTypes.typeName
+    FROM items
+    JOIN itemTypes ON items.itemTypeID = itemTypes.itemTypeID
+    WHERE items.itemID = ?
+    """, (item_id,)).fetchone()[0]
+    date = conn.execute(field_query, (item_id, "date")).fetchone()
+    venue = conn.execute(field_query, (item_id, "publicationTitle" if type_name == "journalArticle"
+                                       else "proceedingsTitle")).fetchone()
+    return len(authors), type_name, date and date[0], venue and venue[0]
+
+
+def legacy_titles(conn):
+    """dedup-by-title.py: every title, attachments skipped by a hard-coded type ID."""
+    return conn.execute("""
+    SELECT i.itemID, idv.value as title
+    FROM items i
+    JOIN itemData id ON i.itemID = id.itemID
+    JOIN itemDataValues idv ON id.valueID = idv.valueID
+    JOIN fields f ON id.fieldID = f.fieldID
+    WHERE f.fieldName = 'title' AND i.itemTypeID != 3
+    """).fetchall()
+
+
+# -- the same through ZoteroDB ------------------------------------------------
+
+def shared_paper_info(db, item_id):
+    type_name = db.item_types([item_id])[item_id]
+    date = db.field_values("date", [item_id]).get(item_id)
+    venue = db.field_values("publicationTitle" if type_name == "journalArticle" else "proceedingsTitle",
+                            [item_id]).get(item_id)
+    return len(db.authors([item_id]).get(item_id, [])), type_name, date, venue
+
+
+def best_of(fn, repeat=3):
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench(items: int, workdir: str):
+    path = os.path.join(workdir, f"zotero-{items}.sqlite")
+    synthetic_library(path, items)
+    rng = random.Random(1)
+    dois = [f"10.1000/{rng.randrange(items)}" for _ in range(min(items, 5000))]
+    paper_ids = [1 + 2 * rng.randrange(items) for _ in range(min(items, 1000))]
+
+    conn = connect_readonly(path, immutable=False)
+    opened, db = best_of(lambda: ZoteroDB(path), repeat=1)
+    cases = [
+        ("DOI lookup", lambda: sorted(legacy_dois(conn, dois), key=lambda row: row[1]),
+         lambda: db.items_by_field_value("DOI", dois)),
+        ("paper info", lambda: [legacy_paper_info(conn, item_id) for item_id in paper_ids],
+         lambda: [shared_paper_info(db, item_id) for item_id in paper_ids]),
+        ("all titles", lambda: legacy_titles(conn), lambda: db.all_field_values("title")),
+    ]
+    for name, legacy, shared in cases:
+        legacy_time, legacy_rows = best_of(legacy)
+        shared_time, shared_rows = best_of(shared)
+        same = sorted(legacy_rows, key=repr) == sorted(shared_rows, key=repr)
+        print(f"{items:>8} {name:<12} {legacy_time * 1000:>10.1f} {shared_time * 1000:>10.1f} "
+              f"{legacy_time / shared_time:>7.1f}x  {same}")
+    print(f"{items:>8} {'(open + IDs)':<12} {'':>10} {opened * 1000:>10.1f}")
+    db.close()
+    conn.close()
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+    print(f"{'items':>8} {'query':<12} {'legacy ms':>10} {'shared ms':>10} {'speedup':>8}  same")
+    with tempfile.TemporaryDirectory() as workdir:
+        for items in sizes:
+            bench(items, workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@ import os
 from datetime import datetime
 import shutil
 
+from zotero_db import ZOTERO_DB_PATH, ZoteroDB
+
 def clean_zotero_trash(zotero_db_path, backup=True):
     """
     Clean the Zotero trash folder by removing deleted items from the SQLite database.
@@ -21,30 +23,18 @@ def clean_zotero_trash(zotero_db_path, backup=True):
         print(f"Created backup at: {backup_path}")
 
     # Connect to the database
-    conn = sqlite3.connect(zotero_db_path)
+    db = ZoteroDB(zotero_db_path, readonly=False)
+    conn = db.conn
     cursor = conn.cursor()
 
     try:
         # First, let's get all items in trash with their titles
-        cursor.execute("""
-            SELECT i.itemID, fields.fieldName, itemDataValues.value
-            FROM items i
-            JOIN deletedItems d ON i.itemID = d.itemID
-            LEFT JOIN itemData ON i.itemID = itemData.itemID
-            LEFT JOIN fields ON itemData.fieldID = fields.fieldID
-            LEFT JOIN itemDataValues ON itemData.valueID = itemDataValues.valueID
-            WHERE fields.fieldName = 'title' OR fields.fieldName IS NULL
-        """)
-        
-        trash_items = cursor.fetchall()
-        deleted_items = set()
-        item_names = []
+        cursor.execute("SELECT itemID FROM deletedItems")
+        deleted_items = set(row[0] for row in cursor.fetchall())
 
         # Get names of items to be deleted
-        for item in trash_items:
-            if item[1] == 'title' and item[2]:
-                item_names.append(item[2])
-            deleted_items.add(item[0])
+        titles = db.field_values('title', deleted_items)
+        item_names = [titles[item_id] for item_id in sorted(deleted_items) if titles.get(item_id)]
 
         # Delete in the correct order to respect foreign key constraints
         delete_queries = [
@@ -114,7 +104,7 @@ def clean_zotero_trash(zotero_db_path, backup=True):
 
 def main():
     # Example usage
-    zotero_path = os.path.expanduser("~/Zotero/zotero.sqlite")
+    zotero_path = ZOTERO_DB_PATH
     
     if not os.path.exists(zotero_path):
         print("Zotero database not found at the default location.")
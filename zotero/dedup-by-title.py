@@ -1,69 +1,35 @@
-import sqlite3
 import os
-import re
 from pathlib import Path
 import time
-from difflib import SequenceMatcher
+
+from zotero_db import ZOTERO_DB_PATH, ZoteroDB
+from title_index import group_similar_titles
 
 def log(message):
     print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {message}")
 
-def normalize_title(title):
-    # Convert to lowercase
-    title = title.lower()
-    # Remove punctuation and special characters
-    title = re.sub(r'[^\w\s]', '', title)
-    # Remove extra whitespace
-    title = ' '.join(title.split())
-    return title
-
-def similar(a, b, threshold=0.9):
-    return SequenceMatcher(None, a, b).ratio() > threshold
-
 # Path to Zotero database
-zotero_path = Path.home() / "Zotero" / "zotero.sqlite"
+zotero_path = Path(ZOTERO_DB_PATH)
 
 # Backup the database
 backup_path = zotero_path.with_suffix('.sqlite.backup')
 os.system(f"cp {zotero_path} {backup_path}")
 log(f"Backup created at {backup_path}")
 
-# Connect to the database
-conn = sqlite3.connect(str(zotero_path))
+# Connect to the database (writable, Zotero must be closed)
+db = ZoteroDB(str(zotero_path), readonly=False)
+conn = db.conn
 cursor = conn.cursor()
 
 log("Fetching items with titles from the database...")
-# Get all items with their titles
-cursor.execute("""
-    SELECT i.itemID, idv.value as title
-    FROM items i
-    JOIN itemData id ON i.itemID = id.itemID
-    JOIN itemDataValues idv ON id.valueID = idv.valueID
-    JOIN fields f ON id.fieldID = f.fieldID
-    WHERE f.fieldName = 'title' AND i.itemTypeID != 14
-""")
-items = cursor.fetchall()
+# Get all items with their titles, attachments are skipped by type name (their ID differs between Zotero versions)
+items = db.all_field_values('title')
 log(f"Fetched {len(items)} items with titles")
 
 # Normalize titles and group similar items
 log("Normalizing titles and grouping similar items...")
-groups = {}
-items_processed = 0
-for item_id, title in items:
-    if title:
-        items_processed += 1
-        normalized_title = normalize_title(title)
-        found = False
-        for key in groups:
-            if similar(key, normalized_title):
-                groups[key].append((item_id, title))
-                found = True
-                break
-        if not found:
-            groups[normalized_title] = [(item_id, title)]
-
-    if items_processed % 100 == 0:
-        log(f"Processed {items_processed} items...")
+groups = group_similar_titles(items, progress=lambda done: log(f"Processed {done} items..."))
+items_processed = sum(len(group) for group in groups.values())
 
 log(f"Processed {items_processed} items with non-empty titles")
 log(f"Identified {len(groups)} unique normalized titles")
@@ -1,86 +1,190 @@
 '''
 Delete duplicates by DOI
+
+Duplicate groups are found inside SQLite (GROUP BY the trimmed, lowercased
+DOI, per library) and every item but the oldest of each group goes into a temp
+table. A handful of set-based statements then clean up after those items in
+one transaction:
+- child attachments and notes are moved to the kept item,
+- its collections, tags and relations are merged into the kept item,
+- its rows in every other table keyed by itemID (itemData, itemCreators,
+  deletedItems, ...) are deleted, and finally the items themselves.
+Tables are looked up in the schema, so tables this Zotero version lacks are
+skipped and new ones are cleaned up too.
+
+Usage: python3 zotero/dedup.py [--dry-run] [--db PATH]
 '''
-import sqlite3
+import argparse
 import os
 from pathlib import Path
 import time
 
+from zotero_db import ZOTERO_DB_PATH, ZoteroDB
+
+# Rows of the duplicate that are given to the kept item instead of being dropped
+MERGED_TABLES = ('collectionItems', 'itemTags', 'itemRelations')
+
 def log(message):
     print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {message}")
 
-# Path to Zotero database
-zotero_path = Path.home() / "Zotero" / "zotero.sqlite"
-
-# Backup the database
-backup_path = zotero_path.with_suffix('.sqlite.backup')
-os.system(f"cp {zotero_path} {backup_path}")
-log(f"Backup created at {backup_path}")
-
-# Connect to the database
-conn = sqlite3.connect(str(zotero_path))
-cursor = conn.cursor()
-
-log("Fetching items with DOIs from the database...")
-# Get all items with their DOIs
-cursor.execute("""
-    SELECT i.itemID, idv.value as doi
-    FROM items i
-    JOIN itemData id ON i.itemID = id.itemID
-    JOIN itemDataValues idv ON id.valueID = idv.valueID
-    JOIN fields f ON id.fieldID = f.fieldID
-    WHERE f.fieldName = 'DOI' AND i.itemTypeID != 14
-""")
-items = cursor.fetchall()
-log(f"Fetched {len(items)} items with DOIs")
-
-# Group items by DOI
-log("Grouping items by DOI...")
-groups = {}
-items_with_doi = 0
-for item_id, doi in items:
-    if doi:
-        items_with_doi += 1
-        doi = doi.strip().lower()  # Normalize DOI
-        if doi in groups:
-            groups[doi].append(item_id)
+def _has_table(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+def item_tables(conn):
+    """{table: [columns]} of every table other than items with an itemID or parentItemID column."""
+    tables = {}
+    for table, column in conn.execute("""
+        SELECT sqlite_master.name, columns.name
+          FROM sqlite_master, pragma_table_info(sqlite_master.name) AS columns
+         WHERE sqlite_master.type = 'table' AND sqlite_master.name != 'items'
+         ORDER BY sqlite_master.name, columns.cid
+    """):
+        tables.setdefault(table, []).append(column)
+    return {table: columns for table, columns in tables.items()
+            if 'itemID' in columns or 'parentItemID' in columns}
+
+def find_duplicates(db):
+    """
+    Fill the temp table duplicate_items (itemID, keepID, doi) with every item
+    sharing its DOI with an older item of the same library (attachments are
+    skipped by type name, their ID differs between Zotero versions).
+    Returns [(doi, keepID, 'itemID,itemID,...')] ordered by keepID.
+    """
+    conn = db.conn
+    excluded = [db.item_type_ids[name] for name in ('attachment',) if name in db.item_type_ids]
+    has_library = any(row[1] == 'libraryID' for row in conn.execute("PRAGMA table_info(items)"))
+    conn.execute("""
+        CREATE TEMP TABLE doi_items AS
+        SELECT {library} AS libraryID, lower(trim(itemDataValues.value, char(32, 9, 10, 13))) AS doi, itemData.itemID
+          FROM itemData
+          JOIN items          ON items.itemID = itemData.itemID
+          JOIN itemDataValues ON itemDataValues.valueID = itemData.valueID
+         WHERE itemData.fieldID = ?
+           AND items.itemTypeID NOT IN ({excluded})
+    """.format(library='items.libraryID' if has_library else '0',
+               excluded=','.join('?' * len(excluded)) or 'NULL'),
+        [db.field_id('DOI')] + excluded)
+    conn.execute("""
+        CREATE TEMP TABLE duplicate_items (itemID INTEGER PRIMARY KEY, keepID INTEGER NOT NULL, doi TEXT NOT NULL)
+    """)
+    conn.execute("""
+        INSERT INTO duplicate_items
+        SELECT doi_items.itemID, kept.keepID, doi_items.doi
+          FROM doi_items
+          JOIN (SELECT libraryID, doi, MIN(itemID) AS keepID
+                  FROM doi_items
+                 WHERE doi != ''
+                 GROUP BY libraryID, doi
+                HAVING COUNT(*) > 1) AS kept
+            ON kept.libraryID = doi_items.libraryID AND kept.doi = doi_items.doi
+         WHERE doi_items.itemID != kept.keepID
+    """)
+    conn.execute("DROP TABLE doi_items")
+    return conn.execute("""
+        SELECT doi, keepID, group_concat(itemID) FROM duplicate_items GROUP BY keepID ORDER BY keepID
+    """).fetchall()
+
+def remove_duplicates(conn, tables):
+    """
+    Move children, merge and delete everything belonging to duplicate_items.
+    Returns [(table, action, rows)] for the report.
+    """
+    changes = []
+    duplicates = "(SELECT itemID FROM duplicate_items)"
+
+    # Attachments and notes (and anything else with a parent) go to the kept item
+    for table, columns in tables.items():
+        if 'parentItemID' in columns:
+            cursor = conn.execute(f"""
+                UPDATE {table}
+                   SET parentItemID = (SELECT keepID FROM duplicate_items WHERE itemID = {table}.parentItemID)
+                 WHERE parentItemID IN {duplicates}
+            """)
+            changes.append((table, 'moved to the kept item', cursor.rowcount))
+
+    # Collections, tags and relations of a duplicate are added to the kept item
+    for table in MERGED_TABLES:
+        if table in tables:
+            columns = tables[table]
+            selected = ', '.join('duplicate_items.keepID' if column == 'itemID' else f'{table}.{column}'
+                                 for column in columns)
+            cursor = conn.execute(f"""
+                INSERT OR IGNORE INTO {table} ({', '.join(columns)})
+                SELECT {selected} FROM {table} JOIN duplicate_items ON duplicate_items.itemID = {table}.itemID
+            """)
+            changes.append((table, 'merged into the kept item', cursor.rowcount))
+
+    # Let Zotero sync delete the duplicates on the server too
+    if _has_table(conn, 'syncDeleteLog') and _has_table(conn, 'syncObjectTypes'):
+        cursor = conn.execute(f"""
+            INSERT OR IGNORE INTO syncDeleteLog (syncObjectTypeID, libraryID, key)
+            SELECT (SELECT syncObjectTypeID FROM syncObjectTypes WHERE name = 'item'), libraryID, key
+              FROM items
+             WHERE itemID IN {duplicates}
+        """)
+        changes.append(('syncDeleteLog', 'logged for sync', cursor.rowcount))
+
+    for table, columns in tables.items():
+        if 'itemID' in columns:
+            cursor = conn.execute(f"DELETE FROM {table} WHERE itemID IN {duplicates}")
+            changes.append((table, 'deleted', cursor.rowcount))
+    cursor = conn.execute(f"DELETE FROM items WHERE itemID IN {duplicates}")
+    changes.append(('items', 'deleted', cursor.rowcount))
+    return changes
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete duplicate Zotero items by DOI")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="report what would change, then roll back (no backup is made)")
+    parser.add_argument('--db', default=ZOTERO_DB_PATH, help="path to zotero.sqlite")
+    args = parser.parse_args()
+
+    # Path to Zotero database
+    zotero_path = Path(args.db)
+
+    # Backup the database
+    if not args.dry_run:
+        backup_path = zotero_path.with_suffix('.sqlite.backup')
+        os.system(f"cp {zotero_path} {backup_path}")
+        log(f"Backup created at {backup_path}")
+
+    # Connect to the database (writable, Zotero must be closed)
+    db = ZoteroDB(str(zotero_path), readonly=False)
+    conn = db.conn
+    started = time.perf_counter()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+
+        log("Grouping items by DOI...")
+        groups = find_duplicates(db)
+        for doi, item_to_keep, items_to_delete in groups:
+            log(f"Duplicate set found for DOI '{doi}':")
+            log(f"  Keeping item {item_to_keep}")
+            log(f"  Deleting items {{{items_to_delete.replace(',', ', ')}}}")
+
+        log("Removing duplicates and their dependent rows...")
+        changes = remove_duplicates(conn, item_tables(conn))
+        for table, action, rows in changes:
+            if rows:
+                log(f"  {table}: {rows} rows {action}")
+
+        if args.dry_run:
+            log("Dry run, rolling back...")
+            conn.rollback()
         else:
-            groups[doi] = [item_id]
-
-log(f"Found {items_with_doi} items with non-empty DOIs")
-log(f"Identified {len(groups)} unique DOIs")
-
-# Process duplicate groups
-log("Processing duplicate groups...")
-total_duplicates = 0
-total_deleted = 0
-
-for doi, item_ids in groups.items():
-    if len(item_ids) > 1:
-        total_duplicates += 1
-        item_to_keep = min(item_ids)
-        items_to_delete = set(item_ids) - {item_to_keep}
-        total_deleted += len(items_to_delete)
-        
-        log(f"Duplicate set found for DOI '{doi}':")
-        log(f"  Keeping item {item_to_keep}")
-        log(f"  Deleting items {items_to_delete}")
-        
-        # Delete the duplicate items
-        cursor.execute("""
-            DELETE FROM items WHERE itemID IN ({})
-        """.format(','.join('?' * len(items_to_delete))), list(items_to_delete))
-        
-        # Delete associated itemData entries
-        cursor.execute("""
-            DELETE FROM itemData WHERE itemID IN ({})
-        """.format(','.join('?' * len(items_to_delete))), list(items_to_delete))
-
-# Commit changes and close connection
-log("Committing changes to the database...")
-conn.commit()
-conn.close()
-
-log(f"Duplicate removal complete. Found {total_duplicates} sets of duplicates.")
-log(f"Deleted {total_deleted} duplicate items.")
-log("Please restart Zotero for changes to take effect.")
+            log("Committing changes to the database...")
+            conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        db.close()
+
+    total_deleted = changes[-1][2]
+    log(f"Duplicate removal complete in {time.perf_counter() - started:.1f}s. Found {len(groups)} sets of duplicates.")
+    log(f"{'Would delete' if args.dry_run else 'Deleted'} {total_deleted} duplicate items.")
+    if not args.dry_run:
+        log("Please restart Zotero for changes to take effect.")
+
+if __name__ == '__main__':
+    main()
@@ -3,15 +3,34 @@
 """
 Download a PDF attachment from Zotero by DOI.
 Save the PDF to a local directory.
+
+The lookup itself is batched: `resolve_pdf_paths` takes a whole list of DOIs
+and resolves them over one read-only connection (see zotero_db.py), so
+`pdf/mass_reader.py` can import it instead of spawning this script once per DOI.
+
+Usage: python3 downloader.py [--link] <DOI>
 """
 
 import sys
-import sqlite3
 import os
+import re
 import shutil
 
-ZOTERO_DB_PATH = os.path.expanduser("~/Zotero/zotero.sqlite")
-ZOTERO_STORAGE_DIR = os.path.expanduser("~/Zotero/storage")
+from zotero_db import ZOTERO_DB_PATH, ZoteroDB, storage_path
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, reflinks are skipped there
+    fcntl = None
+
+# How a PDF is made available under docs/:
+#   none - don't stage at all, read it from Zotero storage
+#   link - reflink (copy-on-write clone), else hardlink, else copy
+#   copy - plain copy
+STAGE_MODES = ("none", "link", "copy")
+
+# ioctl from linux/fs.h, clones a file on Btrfs/XFS without copying data
+FICLONE = 0x40049409
 
 def sanitize_filename(s: str) -> str:
     """
@@ -20,56 +39,114 @@ def sanitize_filename(s: str) -> str:
     """
     return s.replace("/", "_").replace("\\", "_").replace(":", "_")
 
-def get_item_id_by_doi(conn, doi):
-    query = """
-    SELECT items.itemID
-      FROM items
-      JOIN itemData       ON items.itemID = itemData.itemID
-      JOIN itemDataValues ON itemData.valueID = itemDataValues.valueID
-      JOIN fields         ON itemData.fieldID = fields.fieldID
-     WHERE fields.fieldName = 'DOI'
-       AND itemDataValues.value = ?
+def get_item_ids_by_doi(db, dois):
+    """
+    Return {doi: itemID} for every DOI found in the library.
+    When several items share a DOI the lowest itemID wins.
     """
-    cur = conn.cursor()
-    cur.execute(query, (doi,))
-    row = cur.fetchone()
-    return row[0] if row else None
+    item_ids = {}
+    for doi, item_id in db.items_by_field_value("DOI", dois):
+        item_ids.setdefault(doi, item_id)
+    return item_ids
 
-def get_pdf_attachment_path(conn, parent_item_id):
+def get_pdf_attachment_paths(db, parent_item_ids):
     """
+    Return {parentItemID: path on disk} of the first stored PDF attachment.
+
     Example for linkMode=0 scenario with the path stored as 'storage:Filename.pdf'
     and the actual folder name in items.key. Adjust as needed.
     """
-    query = """
-    SELECT items.key,
-           itemAttachments.path
-      FROM itemAttachments
-      JOIN items ON items.itemID = itemAttachments.itemID
-     WHERE itemAttachments.parentItemID = ?
-       AND itemAttachments.linkMode = 0
-       AND itemAttachments.path LIKE '%.pdf'
+    return {
+        parent_id: storage_path(key, raw_path)
+        for parent_id, (key, raw_path) in db.pdf_attachments(parent_item_ids).items()
+    }
+
+def get_item_metadata(db, item_ids):
+    """
+    Return {itemID: {"year": "2023" or None, "collections": [names]}}
+    for every itemID, used to filter papers in the corpus-wide RAG index.
+    """
+    item_ids = list(set(item_ids))
+    dates = db.field_values("date", item_ids)
+    collections = db.collections(item_ids)
+    metadata = {}
+    for item_id in item_ids:
+        match = re.search(r"\b(\d{4})\b", dates.get(item_id) or "")
+        metadata[item_id] = {
+            "year": match.group(1) if match else None,
+            "collections": collections.get(item_id, []),
+        }
+    return metadata
+
+def resolve_pdf_paths(db, dois):
+    """
+    Resolve every DOI to (itemID, pdf_path) with two set-based queries.
+    itemID is None when the DOI is not in Zotero, pdf_path is None when
+    the item has no stored PDF attachment.
+    """
+    item_ids = get_item_ids_by_doi(db, dois)
+    pdf_paths = get_pdf_attachment_paths(db, item_ids.values())
+    resolved = {}
+    for doi in dois:
+        item_id = item_ids.get(doi)
+        resolved[doi] = (item_id, pdf_paths.get(item_id))
+    return resolved
+
+def _reflink(src, dst):
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+
+def _link_or_copy(src, dst):
     """
-    cur = conn.cursor()
-    cur.execute(query, (parent_item_id,))
-    row = cur.fetchone()
-    if not row:
-        return None  # No PDF found
-
-    child_key, raw_path = row
-    # If raw_path includes 'storage:', strip it
-    filename = raw_path
-    if filename.startswith("storage:"):
-        filename = filename[len("storage:"):]
-    # Construct the on-disk path
-    full_path = os.path.join(ZOTERO_STORAGE_DIR, child_key, filename)
-    return full_path
+    Try a reflink first (a real copy-on-write clone), then a hardlink
+    (shares the file with Zotero, fine as long as nobody edits docs/ copies),
+    and only copy the data when both fail, e.g. across filesystems.
+    """
+    for link in (_reflink, os.link):
+        try:
+            link(src, dst)
+            return
+        except OSError:
+            if os.path.lexists(dst):
+                os.remove(dst)
+    shutil.copyfile(src, dst)
+
+def stage_pdf(doi, pdf_path, output_dir="docs", mode="copy"):
+    """
+    Make the PDF available as {output_dir}/{safe_doi}.pdf and return its path.
+    With mode 'none' nothing is staged and pdf_path itself is returned.
+    """
+    if mode not in STAGE_MODES:
+        raise ValueError(f"Unknown stage mode {mode!r}, expected one of {STAGE_MODES}")
+    if mode == "none":
+        return pdf_path
+
+    safe_doi = sanitize_filename(doi)
+    os.makedirs(output_dir, exist_ok=True)
+    output_file = os.path.join(output_dir, f"{safe_doi}.pdf")
+    # Never write through an old link into the file in Zotero storage
+    if os.path.lexists(output_file):
+        os.remove(output_file)
+    if mode == "copy":
+        shutil.copyfile(pdf_path, output_file)
+    else:
+        _link_or_copy(pdf_path, output_file)
+    return output_file
 
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python3 scriptname.py <DOI>")
+    args = sys.argv[1:]
+    mode = "copy"
+    if args and args[0] == "--link":
+        mode = "link"
+        args = args[1:]
+
+    if not args:
+        print("Usage: python3 scriptname.py [--link] <DOI>")
         sys.exit(1)
 
-    doi = sys.argv[1].strip()
+    doi = args[0].strip()
     if not doi:
         print("Error: DOI cannot be empty.")
         sys.exit(1)
@@ -78,16 +155,15 @@ def main():
         print(f"Error: Zotero DB not found at {ZOTERO_DB_PATH}")
         sys.exit(1)
 
-    conn = sqlite3.connect(ZOTERO_DB_PATH)
+    with ZoteroDB() as db:
+        item_id, pdf_path = resolve_pdf_paths(db, [doi])[doi]
 
     # 1. Look up item by DOI
-    item_id = get_item_id_by_doi(conn, doi)
     if not item_id:
         print(f"No Zotero item found with DOI = {doi}")
         sys.exit(0)
 
     # 2. Find PDF path
-    pdf_path = get_pdf_attachment_path(conn, item_id)
     if not pdf_path:
         print(f"No PDF attachment found for DOI = {doi}")
         sys.exit(0)
@@ -96,16 +172,9 @@ def main():
         print(f"Expected PDF file not found on disk: {pdf_path}")
         sys.exit(0)
 
-    # 3. Copy PDF to docs/{safe_doi}.pdf
-    safe_doi = sanitize_filename(doi)
-    output_dir = "docs"
-    os.makedirs(output_dir, exist_ok=True)
-    output_file = os.path.join(output_dir, f"{safe_doi}.pdf")
-
-    shutil.copyfile(pdf_path, output_file)
-    print(f"Copied PDF to {output_file}")
-
-    conn.close()
+    # 3. Copy (or link) PDF to docs/{safe_doi}.pdf
+    output_file = stage_pdf(doi, pdf_path, mode=mode)
+    print(f"Copied PDF to {output_file}" if mode == "copy" else f"Linked PDF to {output_file}")
 
 if __name__ == "__main__":
     main()
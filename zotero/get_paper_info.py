@@ -1,83 +1,11 @@
 #!/usr/bin/env python3
 
-import sqlite3
 import csv
 import sys
-import os
 import re
 
-def get_item_id_by_title(conn, title):
-    """
-    Return a list of itemIDs matching a given title (exact match).
-    """
-    query = """
-    SELECT items.itemID
-    FROM items
-    JOIN itemData ON items.itemID = itemData.itemID
-    JOIN itemDataValues ON itemData.valueID = itemDataValues.valueID
-    JOIN fields ON itemData.fieldID = fields.fieldID
-    WHERE fields.fieldName = 'title'
-      AND itemDataValues.value = ?
-    """
-    cur = conn.cursor()
-    cur.execute(query, (title,))
-    rows = cur.fetchall()
-    return [r[0] for r in rows]
-
-def get_item_type(conn, item_id):
-    """
-    Return the typeName (e.g. 'journalArticle', 'conferencePaper') for a given itemID.
-    """
-    query = """
-    SELECT itemTypes.typeName
-    FROM items
-    JOIN itemTypes ON items.itemTypeID = itemTypes.itemTypeID
-    WHERE items.itemID = ?
-    """
-    cur = conn.cursor()
-    cur.execute(query, (item_id,))
-    row = cur.fetchone()
-    return row[0] if row else None
-
-def get_authors(conn, item_id):
-    """
-    Return a list of author names for a given itemID.
-    """
-    query = """
-    SELECT creators.lastName, creators.firstName
-    FROM itemCreators
-    JOIN creators ON itemCreators.creatorID = creators.creatorID
-    JOIN creatorTypes ON itemCreators.creatorTypeID = creatorTypes.creatorTypeID
-    WHERE itemCreators.itemID = ?
-      AND creatorTypes.creatorType = 'author'
-    ORDER BY itemCreators.orderIndex
-    """
-    cur = conn.cursor()
-    cur.execute(query, (item_id,))
-    authors = []
-    for last_name, first_name in cur.fetchall():
-        if first_name:
-            authors.append(f"{first_name} {last_name}")
-        else:
-            authors.append(last_name)
-    return authors
-
-def get_field_value(conn, item_id, field_name):
-    """
-    Return the value of a specific Zotero field (e.g. 'publicationTitle', 'date') for a given itemID.
-    """
-    query = """
-    SELECT itemDataValues.value
-    FROM itemData
-    JOIN itemDataValues ON itemData.valueID = itemDataValues.valueID
-    JOIN fields ON itemData.fieldID = fields.fieldID
-    WHERE itemData.itemID = ?
-      AND fields.fieldName = ?
-    """
-    cur = conn.cursor()
-    cur.execute(query, (item_id, field_name))
-    row = cur.fetchone()
-    return row[0] if row else None
+from zotero_db import ZoteroDB
+from title_index import TitleIndex
 
 def parse_year(zotero_date):
     """
@@ -91,92 +19,162 @@ def parse_year(zotero_date):
         return match.group(1)
     return None
 
-def determine_type_and_venue(item_type_name, conn, item_id):
+# Fields pulled for every matched item, pivoted into one row per item
+PIVOT_FIELDS = ('title', 'date', 'publicationTitle', 'proceedingsTitle', 'conferenceName')
+
+def determine_type_and_venue(item_type_name, fields):
     """
     Determine whether the item is a 'conference' or 'journal' based on typeName,
-    and extract a relevant 'venue' from the appropriate Zotero field.
+    and extract a relevant 'venue' from its already loaded fields.
     """
     if item_type_name == 'journalArticle':
         # Journal
-        return 'journal', get_field_value(conn, item_id, 'publicationTitle')
+        return 'journal', fields['publicationTitle']
     elif item_type_name == 'conferencePaper':
         # Conference
-        venue = get_field_value(conn, item_id, 'proceedingsTitle')
-        if not venue:
-            venue = get_field_value(conn, item_id, 'conferenceName')
-        return 'conference', venue
+        return 'conference', fields['proceedingsTitle'] or fields['conferenceName']
     else:
         # For everything else, label as 'other'
         return 'other', None
 
+def _inexact_matches(db, unmatched):
+    """
+    (position, itemID, match, rank) rows for titles without an exact match:
+    the same title after normalization, else up to FUZZY_LIMIT ranked
+    fuzzy candidates from the trigram index.
+    """
+    index = TitleIndex(db.all_field_values('title'))
+    for position, title in unmatched:
+        item_ids = index.lookup_exact(title)
+        for item_id in item_ids:
+            yield position, item_id, 'normalized', 0
+        if item_ids:
+            continue
+        for rank, (score, _, candidate_ids) in enumerate(index.candidates(title), start=1):
+            for item_id in candidate_ids:
+                yield position, item_id, f'fuzzy {score:.2f}', rank
+
+def iter_paper_info(db, titles, fuzzy=True):
+    """
+    Yield one CSV row per (title, matched item) in input order, or a
+    'not found' row for a title without matches, using a handful of
+    set-based queries instead of five queries per title.
+
+    The titles go into a temp table (allowed on the read-only connection,
+    it lives in SQLite's temp database), matches are found in one pass over
+    the title rows of itemData, and date and venue are pivoted out of
+    itemData by field ID. With fuzzy, titles without an exact match are
+    looked up in a TitleIndex, built only when such titles exist.
+    """
+    conn = db.conn
+    conn.execute("DROP TABLE IF EXISTS temp.wanted_titles")
+    conn.execute("DROP TABLE IF EXISTS temp.matched_items")
+    conn.execute("CREATE TEMP TABLE wanted_titles (position INTEGER PRIMARY KEY, title TEXT NOT NULL)")
+    conn.execute("CREATE INDEX temp.wanted_titles_title ON wanted_titles (title)")
+    conn.executemany("INSERT INTO wanted_titles (title) VALUES (?)", ((title,) for title in titles))
+    conn.execute("""
+    CREATE TEMP TABLE matched_items (
+        position INTEGER NOT NULL,
+        itemID   INTEGER NOT NULL,
+        match    TEXT NOT NULL,
+        rank     INTEGER NOT NULL
+    )
+    """)
+    conn.execute("""
+    INSERT INTO matched_items (position, itemID, match, rank)
+    SELECT wanted_titles.position, itemData.itemID, 'exact', 0
+      FROM itemData
+      CROSS JOIN itemDataValues ON itemDataValues.valueID = itemData.valueID
+      JOIN wanted_titles ON wanted_titles.title = itemDataValues.value
+     WHERE itemData.fieldID = ?
+    """, (db.field_id('title'),))
+    if fuzzy:
+        unmatched = conn.execute("""
+        SELECT position, title FROM wanted_titles
+         WHERE position NOT IN (SELECT position FROM matched_items)
+        """).fetchall()
+        if unmatched:
+            conn.executemany("INSERT INTO matched_items VALUES (?, ?, ?, ?)", list(_inexact_matches(db, unmatched)))
+    conn.execute("CREATE INDEX temp.matched_items_itemID ON matched_items (itemID)")
+
+    authors = {}
+    for item_id, last_name, first_name in conn.execute("""
+    SELECT itemCreators.itemID, creators.lastName, creators.firstName
+      FROM (SELECT DISTINCT itemID FROM matched_items) AS matched
+      JOIN itemCreators ON itemCreators.itemID = matched.itemID
+      JOIN creators     ON creators.creatorID = itemCreators.creatorID
+     WHERE itemCreators.creatorTypeID = ?
+     ORDER BY itemCreators.itemID, itemCreators.orderIndex
+    """, (db.creator_type_id('author'),)):
+        authors.setdefault(item_id, []).append(f"{first_name} {last_name}" if first_name else last_name)
+
+    # A field missing from this Zotero version pivots to NULL
+    field_ids = [db.field_ids.get(name) for name in PIVOT_FIELDS]
+    pivot = ",\n".join(
+        f"MAX(CASE WHEN itemData.fieldID = ? THEN itemDataValues.value END) AS {name}" for name in PIVOT_FIELDS
+    )
+    rows = conn.execute(f"""
+    SELECT wanted_titles.title, matched_items.itemID, matched_items.match, items.itemTypeID,
+           {pivot}
+      FROM wanted_titles
+      LEFT JOIN matched_items  ON matched_items.position = wanted_titles.position
+      LEFT JOIN items          ON items.itemID = matched_items.itemID
+      LEFT JOIN itemData       ON itemData.itemID = matched_items.itemID
+                              AND itemData.fieldID IN ({",".join("?" * len(field_ids))})
+      LEFT JOIN itemDataValues ON itemDataValues.valueID = itemData.valueID
+     GROUP BY wanted_titles.position, matched_items.rank, matched_items.itemID
+     ORDER BY wanted_titles.position, matched_items.rank, matched_items.itemID
+    """, field_ids + field_ids)
+    for title, item_id, match, item_type_id, *values in rows:
+        if item_id is None:
+            yield {'title': title, 'authors': 'not found', 'year': '', 'type': '', 'venue': '',
+                   'match': '', 'zotero_title': ''}
+            continue
+        fields = dict(zip(PIVOT_FIELDS, values))
+        type_str, venue_str = determine_type_and_venue(db.item_type_names.get(item_type_id), fields)
+        yield {
+            'title': title,
+            'authors': "; ".join(authors.get(item_id, [])),
+            'year': parse_year(fields['date']) or '',
+            'type': type_str,
+            'venue': venue_str or '',
+            'match': match,
+            'zotero_title': fields['title'] or '',
+        }
+
 def main():
+    # --exact turns off normalized and fuzzy title matching
+    args = sys.argv[1:]
+    fuzzy = '--exact' not in args
+    args = [arg for arg in args if arg != '--exact']
+
     # Optional: read output.csv path from command line, otherwise default
-    if len(sys.argv) > 1:
-        output_csv = sys.argv[1]
+    if args:
+        output_csv = args[0]
     else:
         output_csv = 'output.csv'
 
-    # Adjust to your actual Zotero database path
-    db_path = os.path.expanduser("~/Zotero/zotero.sqlite")
-
-    # Connect to the Zotero database
-    conn = sqlite3.connect(db_path)
-
-    # Prepare to store results
-    results = []
+    # Connect to the Zotero database (read-only, works while Zotero is open)
+    db = ZoteroDB()
 
-    # Read titles from 'input.txt'
+    # Read titles from 'input.txt', skipping any empty lines
     input_file = 'input.txt'
     with open(input_file, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
+        titles = [line.strip() for line in f if line.strip()]
 
-    for line in lines:
-        title = line.strip()
-        if not title:
-            # Skip any empty lines
-            continue
-
-        # Find item(s) in Zotero
-        item_ids = get_item_id_by_title(conn, title)
-
-        if not item_ids:
-            # If no match is found, write a row with minimal info or placeholders
-            results.append({
-                'title': title,
-                'authors': 'not found',
-                'year': '',
-                'type': '',
-                'venue': ''
-            })
-        else:
-            # If we have matches, gather info for each matched item
-            for item_id in item_ids:
-                authors_list = get_authors(conn, item_id)
-                authors_str = "; ".join(authors_list)
-
-                zotero_date = get_field_value(conn, item_id, 'date')
-                year_str = parse_year(zotero_date)
-
-                item_type_name = get_item_type(conn, item_id)
-                type_str, venue_str = determine_type_and_venue(item_type_name, conn, item_id)
-
-                results.append({
-                    'title': title,
-                    'authors': authors_str,
-                    'year': year_str if year_str else '',
-                    'type': type_str,
-                    'venue': venue_str if venue_str else ''
-                })
-
-    # Write out to CSV
-    fieldnames = ['title', 'authors', 'year', 'type', 'venue']
+    # Write out to CSV as the rows come in
+    fieldnames = ['title', 'authors', 'year', 'type', 'venue', 'match', 'zotero_title']
+    written = 0
     with open(output_csv, mode='w', newline='', encoding='utf-8') as f:
         writer = csv.DictWriter(f, fieldnames=fieldnames)
         writer.writeheader()
-        for row in results:
+        for row in iter_paper_info(db, titles, fuzzy):
             writer.writerow(row)
+            written += 1
+
+    db.close()
 
-    print(f"Wrote {len(results)} rows to '{output_csv}' from '{input_file}'.")
+    print(f"Wrote {written} rows to '{output_csv}' from '{input_file}'.")
 
 if __name__ == "__main__":
     main()
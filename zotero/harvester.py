@@ -1,11 +1,19 @@
 import csv
 import asyncio
+import time
 import aiohttp
 from tqdm import tqdm
 import os
+import sys
 import anthropic
 from bs4 import BeautifulSoup
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pdf"))
+from telemetry import MAX_RETRIES, Telemetry, is_retryable, retry_delay
+from llm_cache import ResponseCache, cache_key
+
+ANTHROPIC_MODEL = "claude-3-sonnet-20240229"
+
 def extract_body_text(html_content):
     soup = BeautifulSoup(html_content, 'html.parser')
     
@@ -26,40 +34,67 @@ def extract_body_text(html_content):
         return text
     return ""
 
-async def extract_abstract_with_anthropic(body_text, client):
-    try:
-        message = await client.messages.create(
-            model="claude-3-sonnet-20240229",
-            max_tokens=1000,
-            temperature=0,
-            messages=[{
-                "role": "user",
-                "content": f"""Extract the abstract from this text of a scientific article. Return only the abstract without any introductory text. If no abstract is found, return "No abstract found."
+async def extract_abstract_with_anthropic(body_text, client, telemetry=None, doi=None, cache=None):
+    messages = [{
+        "role": "user",
+        "content": f"""Extract the abstract from this text of a scientific article. Return only the abstract without any introductory text. If no abstract is found, return "No abstract found."
 
 Article Text:
 {body_text[:10000]}"""  # Truncating to first 10000 characters
-            }]
-        )
+    }]
+    key = cache_key(ANTHROPIC_MODEL, messages, {"max_tokens": 1000, "temperature": 0})
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    started = time.perf_counter()
+    retries = 0
+    try:
+        while True:
+            try:
+                message = await client.messages.create(
+                    model=ANTHROPIC_MODEL,
+                    max_tokens=1000,
+                    temperature=0,
+                    messages=messages
+                )
+                break
+            except Exception as e:
+                if retries < MAX_RETRIES and is_retryable(e):
+                    retries += 1
+                    await asyncio.sleep(retry_delay(retries))
+                    continue
+                raise
+        if telemetry is not None:
+            telemetry.record("llm", ANTHROPIC_MODEL, time.perf_counter() - started, retries=retries,
+                             prompt_tokens=message.usage.input_tokens,
+                             completion_tokens=message.usage.output_tokens, paper=doi)
+        if cache is not None:
+            cache.put(key, ANTHROPIC_MODEL, message.content[0].text,
+                      message.usage.input_tokens, message.usage.output_tokens)
         return message.content[0].text
     except Exception as e:
+        if telemetry is not None:
+            telemetry.record("llm", ANTHROPIC_MODEL, time.perf_counter() - started, paper=doi,
+                             retries=retries, error=str(e))
         return f"Error: {str(e)}"
 
-async def get_abstract_from_html(session, doi, client):
+async def get_abstract_from_html(session, doi, client, telemetry=None, cache=None):
     url = f"https://doi.org/{doi}"
     async with session.get(url, allow_redirects=True) as response:
         if response.status == 200:
             html_content = await response.text()
             body_text = extract_body_text(html_content)
-            abstract = await extract_abstract_with_anthropic(body_text, client)
+            abstract = await extract_abstract_with_anthropic(body_text, client, telemetry, doi, cache)
             return abstract
     return None
 
-async def process_entry(session, entry, client):
+async def process_entry(session, entry, client, telemetry=None, cache=None):
     if not entry or len(entry) < 2:  # skipping title
         return None, None, None
     doi, title = entry[0], entry[1]
     try:
-        abstract = await get_abstract_from_html(session, doi, client)
+        abstract = await get_abstract_from_html(session, doi, client, telemetry, cache)
         return doi, title, abstract
     except Exception as e:
         print(f"Error processing DOI {doi}: {str(e)}")
@@ -83,12 +118,16 @@ async def harvest_abstracts(input_file, output_file, anthropic_api_key, batch_si
     total_entries = len(entries)
     results_buffer = []
 
-    client = anthropic.AsyncAnthropic(api_key=anthropic_api_key)
+    # Retried in extract_abstract_with_anthropic, where the retries are counted for telemetry
+    client = anthropic.AsyncAnthropic(api_key=anthropic_api_key, max_retries=0)
+    telemetry = Telemetry("harvester.py")
+    # LITREVIEW_LLM_CACHE=refresh or bypass skips cached abstracts
+    cache = ResponseCache()
 
     async with aiohttp.ClientSession() as session:
         with tqdm(total=total_entries, desc="Processing entries") as pbar:
             for entry in entries:
-                result = await process_entry(session, entry, client)
+                result = await process_entry(session, entry, client, telemetry, cache)
                 if result[0] is not None:  # Only add valid results to the buffer
                     results_buffer.append(result)
                 # Write results to file when buffer reaches batch_size
@@ -102,6 +141,10 @@ async def harvest_abstracts(input_file, output_file, anthropic_api_key, batch_si
     if results_buffer:
         write_results(results_buffer, output_file)
 
+    print(cache.stats())
+    cache.close()
+    print(telemetry.summary())
+
 if __name__ == "__main__":
     input_file = "/home/kiote/small_collection.csv"
     output_file = "/home/kiote/collection_abstract.csv"
@@ -0,0 +1,193 @@
+"""
+In-memory indexes of Zotero titles: lookups that survive differences in
+case, punctuation and truncation, e.g. titles pasted from Google Scholar,
+and near-duplicate grouping for dedup-by-title.py.
+
+Titles are normalized with the rules dedup-by-title.py has always used
+(lowercase, no punctuation, single spaces). An exact normalized match wins;
+otherwise the words of the normalized title are looked up in an inverted
+index. A title that contains half of the query's words must contain one of
+its rarest half (prefix filtering), so a lookup reads a few short posting
+lists instead of every title in the library. The candidates are then
+verified and ranked on character trigrams, which tolerate typos and a word
+cut off by truncation.
+
+group_similar_titles replays dedup-by-title.py's greedy grouping, but only
+compares a title with group keys that share some of its rarest words
+instead of with every key; see its docstring.
+"""
+
+import math
+import re
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+
+NGRAM = 3
+# Share of the query's words a title must contain to be considered at all
+WORD_THRESHOLD = 0.5
+# Share of the query's trigrams a title must contain to be a fuzzy candidate
+FUZZY_THRESHOLD = 0.7
+FUZZY_LIMIT = 3
+
+# dedup-by-title.py: SequenceMatcher ratio above which two titles are duplicates
+SIMILARITY_THRESHOLD = 0.9
+# Titles that differ in more words than this are never compared
+WORD_EDITS = 4
+# Blocking words a title must share with a group key to be compared with it
+BLOCK_HITS = 2
+# Words in more than this share of titles (and more than 100) don't block
+BLOCK_MAX_SHARE = 0.005
+
+
+def normalize_title(title):
+    # Convert to lowercase
+    title = title.lower()
+    # Remove punctuation and special characters
+    title = re.sub(r'[^\w\s]', '', title)
+    # Remove extra whitespace
+    title = ' '.join(title.split())
+    return title
+
+
+def similar(a, b, threshold=SIMILARITY_THRESHOLD):
+    return SequenceMatcher(None, a, b).ratio() > threshold
+
+
+def ngrams(normalized, n=NGRAM):
+    """Character n-grams of a normalized title, padded so word starts and ends count."""
+    padded = f" {normalized} "
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+class TitleIndex:
+    """Built once from [(itemID, title)]; one entry per distinct normalized title."""
+
+    def __init__(self, items):
+        self.entries = []       # normalized titles
+        self.entry_items = []   # [itemIDs] per entry
+        self.exact = {}         # normalized title -> entry
+        self.postings = defaultdict(list)  # word -> [entries]
+        for item_id, title in items:
+            if not title:
+                continue
+            normalized = normalize_title(title)
+            entry = self.exact.get(normalized)
+            if entry is None:
+                entry = self.exact[normalized] = len(self.entries)
+                self.entries.append(normalized)
+                self.entry_items.append([])
+                for word in set(normalized.split()):
+                    self.postings[word].append(entry)
+            self.entry_items[entry].append(item_id)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup_exact(self, title):
+        """itemIDs whose normalized title equals this one's."""
+        entry = self.exact.get(normalize_title(title))
+        return [] if entry is None else sorted(self.entry_items[entry])
+
+    def candidates(self, title, threshold=FUZZY_THRESHOLD, limit=FUZZY_LIMIT):
+        """
+        [(score, normalized title, [itemIDs])], best first. score is the share
+        of the query's trigrams found in the title, so a truncated query still
+        scores high against the full title; ties go to the closer length.
+        """
+        normalized = normalize_title(title)
+        words = set(normalized.split())
+        if not words:
+            return []
+        # A title with half of the query's words has one of its rarest len - needed + 1
+        needed_words = math.ceil(WORD_THRESHOLD * len(words))
+        rarest = sorted(words, key=lambda word: len(self.postings.get(word, ())))
+        seen = set()
+        for word in rarest[:len(words) - needed_words + 1]:
+            seen.update(self.postings.get(word, ()))
+
+        query = ngrams(normalized)
+        needed = math.ceil(threshold * len(query))
+        ranked = []
+        for entry in seen:
+            # Counting shared words is much cheaper than building the trigrams
+            if len(words.intersection(self.entries[entry].split())) < needed_words:
+                continue
+            grams = ngrams(self.entries[entry])
+            shared = len(query & grams)
+            if shared >= needed:
+                dice = 2 * shared / (len(query) + len(grams))
+                ranked.append((shared / len(query), dice, entry))
+        ranked.sort(key=lambda candidate: (-candidate[0], -candidate[1], candidate[2]))
+        return [(score, self.entries[entry], sorted(self.entry_items[entry]))
+                for score, _, entry in ranked[:limit]]
+
+
+def group_similar_titles(items, threshold=SIMILARITY_THRESHOLD, word_edits=WORD_EDITS, progress=None):
+    """
+    {normalized key: [(itemID, title)]} like dedup-by-title.py always built
+    it: titles in order, each joins the earliest group whose key is
+    similar(key, title), otherwise starts a group keyed by itself.
+
+    Comparing every title with every key is quadratic, so keys are blocked
+    on words. Words are ordered globally by how many titles contain them,
+    and each key is indexed under its word_edits + BLOCK_HITS rarest words.
+    Two titles that differ in at most word_edits words share at least
+    BLOCK_HITS of those (prefix filtering), so only keys hit that often are
+    verified, earliest first, with the same ratio() test. Titles further
+    apart, which similar() rarely accepts, can end up in separate groups;
+    very common words are left out of blocking so that short titles of
+    common words don't make it quadratic again.
+    """
+    normalized = [(item_id, title, normalize_title(title)) for item_id, title in items if title]
+    frequency = Counter(word for _, _, key in normalized for word in set(key.split()))
+    max_frequency = max(100, int(len(normalized) * BLOCK_MAX_SHARE))
+    shortest, longest = threshold / (2 - threshold), (2 - threshold) / threshold
+
+    keys, key_lengths, key_words, members = [], [], [], []
+    exact = {}
+    postings = defaultdict(list)  # blocking word -> [groups]
+    # Caches what it knows about the second sequence, which is the new title
+    matcher = SequenceMatcher(None)
+    for done, (item_id, title, normalized_title) in enumerate(normalized, start=1):
+        words = set(normalized_title.split())
+        blocking = sorted((word for word in words if frequency[word] <= max_frequency),
+                          key=lambda word: (frequency[word], word))[:word_edits + BLOCK_HITS]
+        hits = Counter()
+        for word in blocking:
+            hits.update(postings.get(word, ()))
+        needed = min(BLOCK_HITS, max(1, len(blocking) - word_edits))
+        # ratio() can't exceed the threshold for keys much shorter or longer
+        low, high = shortest * len(normalized_title), longest * len(normalized_title)
+        candidates = {group for group, count in hits.items()
+                      if count >= needed and low <= key_lengths[group] <= high}
+        if normalized_title in exact:
+            candidates.add(exact[normalized_title])
+
+        found = None
+        compared = False
+        for group in sorted(candidates):
+            if len(words & key_words[group]) < max(len(words), len(key_words[group])) - word_edits:
+                continue
+            if not compared:
+                matcher.set_seq2(normalized_title)
+                compared = True
+            matcher.set_seq1(keys[group])
+            if matcher.real_quick_ratio() > threshold and matcher.quick_ratio() > threshold \
+                    and matcher.ratio() > threshold:
+                found = group
+                break
+
+        if found is None:
+            found = len(keys)
+            keys.append(normalized_title)
+            key_lengths.append(len(normalized_title))
+            key_words.append(words)
+            members.append([])
+            exact.setdefault(normalized_title, found)
+            for word in blocking:
+                postings[word].append(found)
+        members[found].append((item_id, title))
+        if progress is not None and done % 10000 == 0:
+            progress(done)
+
+    return dict(zip(keys, members))
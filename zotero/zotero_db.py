@@ -0,0 +1,233 @@
+"""
+Shared access to the Zotero database for the scripts in zotero/ and pdf/mass_reader.py.
+
+Readers open zotero.sqlite read-only in immutable URI mode: SQLite takes no
+locks and never touches the -journal/-wal files, so it works while Zotero
+(which keeps the database locked) is running. The price is that changes Zotero
+makes during the read are not seen; every script here is a short batch job,
+so that is fine. dedup.py and clean-trash.py write and need Zotero closed.
+
+The fields, itemTypes and creatorTypes tables are read once per connection,
+so queries filter itemData by fieldID directly and hit its
+(itemID, fieldID) primary key or fieldID index instead of joining `fields`
+and comparing fieldName in every statement. Lists of IDs or values are
+bound in batches padded with NULLs to a few fixed sizes, so each statement
+text is compiled once and then reused from sqlite3's statement cache.
+"""
+
+import os
+import sqlite3
+from pathlib import Path
+
+ZOTERO_DIR = os.path.expanduser("~/Zotero")
+ZOTERO_DB_PATH = os.path.join(ZOTERO_DIR, "zotero.sqlite")
+ZOTERO_STORAGE_DIR = os.path.join(ZOTERO_DIR, "storage")
+
+# Stay well below SQLite's limit on host parameters per statement
+SQL_BATCH_SIZE = 500
+# Batches are padded up to one of these sizes, so only a handful of statements get compiled
+BATCH_BUCKETS = (1, 8, 64, SQL_BATCH_SIZE)
+
+
+def connect_readonly(db_path=ZOTERO_DB_PATH, immutable=True):
+    """
+    Open the Zotero database read-only. With immutable=False SQLite still
+    takes shared locks and fails with "database is locked" while Zotero runs.
+    """
+    # as_uri() percent-encodes the path, a '#', '?' or '%' in it would otherwise end or change the URI
+    uri = Path(db_path).resolve().as_uri()
+    return sqlite3.connect(f"{uri}?mode=ro{'&immutable=1' if immutable else ''}", uri=True)
+
+
+def connect_writable(db_path=ZOTERO_DB_PATH):
+    """For the scripts that modify the library; close Zotero first."""
+    return sqlite3.connect(db_path, timeout=30)
+
+
+def _batches(values, size=SQL_BATCH_SIZE):
+    """Batches of values padded with None (NULL never matches IN) up to the next bucket size."""
+    values = list(values)
+    for i in range(0, len(values), size):
+        batch = values[i:i + size]
+        padded = next((bucket for bucket in BATCH_BUCKETS if bucket >= len(batch)), len(batch))
+        yield batch + [None] * (padded - len(batch))
+
+
+def _placeholders(batch):
+    return ",".join("?" * len(batch))
+
+
+class ZoteroDB:
+    """
+    A connection plus the field, item type and creator type IDs of this
+    library, loaded once. Usable as a context manager.
+    """
+
+    def __init__(self, db_path=ZOTERO_DB_PATH, readonly=True, immutable=True):
+        self.path = db_path
+        if readonly:
+            self.conn = connect_readonly(db_path, immutable)
+        else:
+            self.conn = connect_writable(db_path)
+        self.field_ids = dict(self.conn.execute("SELECT fieldName, fieldID FROM fields"))
+        self.item_type_ids = dict(self.conn.execute("SELECT typeName, itemTypeID FROM itemTypes"))
+        self.item_type_names = {type_id: name for name, type_id in self.item_type_ids.items()}
+        self.creator_type_ids = dict(self.conn.execute("SELECT creatorType, creatorTypeID FROM creatorTypes"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def field_id(self, field_name):
+        try:
+            return self.field_ids[field_name]
+        except KeyError:
+            raise KeyError(f"Zotero field {field_name!r} not found in {self.path}") from None
+
+    def item_type_id(self, type_name):
+        try:
+            return self.item_type_ids[type_name]
+        except KeyError:
+            raise KeyError(f"Zotero item type {type_name!r} not found in {self.path}") from None
+
+    def creator_type_id(self, creator_type):
+        try:
+            return self.creator_type_ids[creator_type]
+        except KeyError:
+            raise KeyError(f"Zotero creator type {creator_type!r} not found in {self.path}") from None
+
+    # -- itemData by field ID -------------------------------------------------
+
+    def all_field_values(self, field_name, exclude_types=("attachment",)):
+        """
+        [(itemID, value)] of every item that has the field, skipping items
+        of exclude_types (attachments by default).
+        """
+        excluded = [self.item_type_ids[name] for name in exclude_types if name in self.item_type_ids]
+        query = f"""
+        SELECT itemData.itemID, itemDataValues.value
+          FROM itemData
+          JOIN items          ON items.itemID = itemData.itemID
+          JOIN itemDataValues ON itemDataValues.valueID = itemData.valueID
+         WHERE itemData.fieldID = ?
+           AND items.itemTypeID NOT IN ({_placeholders(excluded) or 'NULL'})
+        """
+        return self.conn.execute(query, [self.field_id(field_name)] + excluded).fetchall()
+
+    def field_values(self, field_name, item_ids):
+        """{itemID: value} of one field for the given items (missing ones left out)."""
+        query = """
+        SELECT itemData.itemID, itemDataValues.value
+          FROM itemData
+          JOIN itemDataValues ON itemDataValues.valueID = itemData.valueID
+         WHERE itemData.fieldID = ?
+           AND itemData.itemID IN ({})
+        """
+        field_id = self.field_id(field_name)
+        values = {}
+        for batch in _batches(set(item_ids)):
+            values.update(self.conn.execute(query.format(_placeholders(batch)), [field_id] + batch))
+        return values
+
+    def items_by_field_value(self, field_name, values):
+        """
+        [(value, itemID)] of items whose field equals one of values, ordered by itemID.
+        itemData has no index on valueID, so every batch walks the field's rows;
+        beyond one batch a single pass over all of them is cheaper.
+        """
+        field_id = self.field_id(field_name)
+        values = set(values)
+        if len(values) > SQL_BATCH_SIZE:
+            query = """
+            SELECT itemDataValues.value, itemData.itemID
+              FROM itemData
+              JOIN itemDataValues ON itemDataValues.valueID = itemData.valueID
+             WHERE itemData.fieldID = ?
+            """
+            rows = [row for row in self.conn.execute(query, (field_id,)) if row[0] in values]
+        else:
+            query = """
+            SELECT itemDataValues.value, itemData.itemID
+              FROM itemDataValues
+              JOIN itemData ON itemData.valueID = itemDataValues.valueID
+             WHERE itemDataValues.value IN ({})
+               AND itemData.fieldID = ?
+            """
+            rows = []
+            for batch in _batches(values):
+                rows.extend(self.conn.execute(query.format(_placeholders(batch)), batch + [field_id]))
+        return sorted(rows, key=lambda row: row[1])
+
+    # -- other per-item lookups -----------------------------------------------
+
+    def item_types(self, item_ids):
+        """{itemID: typeName}"""
+        query = "SELECT itemID, itemTypeID FROM items WHERE itemID IN ({})"
+        types = {}
+        for batch in _batches(set(item_ids)):
+            for item_id, type_id in self.conn.execute(query.format(_placeholders(batch)), batch):
+                types[item_id] = self.item_type_names.get(type_id)
+        return types
+
+    def authors(self, item_ids):
+        """{itemID: ["First Last", ...]} in Zotero's order; items without authors are left out."""
+        query = """
+        SELECT itemCreators.itemID, creators.lastName, creators.firstName
+          FROM itemCreators
+          JOIN creators ON creators.creatorID = itemCreators.creatorID
+         WHERE itemCreators.itemID IN ({})
+           AND itemCreators.creatorTypeID = ?
+         ORDER BY itemCreators.itemID, itemCreators.orderIndex
+        """
+        author_type = self.creator_type_id("author")
+        authors = {}
+        for batch in _batches(set(item_ids)):
+            for item_id, last_name, first_name in self.conn.execute(
+                    query.format(_placeholders(batch)), batch + [author_type]):
+                authors.setdefault(item_id, []).append(f"{first_name} {last_name}" if first_name else last_name)
+        return authors
+
+    def pdf_attachments(self, parent_item_ids):
+        """{parentItemID: (attachment key, stored path)} of the first stored PDF attachment."""
+        query = """
+        SELECT itemAttachments.parentItemID, items.key, itemAttachments.path
+          FROM itemAttachments
+          JOIN items ON items.itemID = itemAttachments.itemID
+         WHERE itemAttachments.parentItemID IN ({})
+           AND itemAttachments.linkMode = 0
+           AND itemAttachments.path LIKE '%.pdf'
+         ORDER BY itemAttachments.itemID
+        """
+        attachments = {}
+        for batch in _batches(set(parent_item_ids)):
+            for parent_id, key, path in self.conn.execute(query.format(_placeholders(batch)), batch):
+                attachments.setdefault(parent_id, (key, path))
+        return attachments
+
+    def collections(self, item_ids):
+        """{itemID: [collection names]} sorted by name; items in no collection are left out."""
+        query = """
+        SELECT collectionItems.itemID, collections.collectionName
+          FROM collectionItems
+          JOIN collections ON collections.collectionID = collectionItems.collectionID
+         WHERE collectionItems.itemID IN ({})
+         ORDER BY collections.collectionName
+        """
+        collections = {}
+        for batch in _batches(set(item_ids)):
+            for item_id, name in self.conn.execute(query.format(_placeholders(batch)), batch):
+                collections.setdefault(item_id, []).append(name)
+        return collections
+
+
+def storage_path(key, stored_path, storage_dir=ZOTERO_STORAGE_DIR):
+    """On-disk path of an attachment stored as 'storage:Filename.pdf' under storage/<key>/."""
+    filename = stored_path
+    if filename.startswith("storage:"):
+        filename = filename[len("storage:"):]
+    return os.path.join(storage_dir, key, filename)